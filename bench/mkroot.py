@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Builds a synthetic Gentoo root for benchmarking: a vdb (var/db/pkg) with N
+packages, a minimal portage configuration and profile, a world file and the
+gentoostats config files.
+
+Usage: mkroot.py ROOT N [SEED]
+
+For a given Python version, the output only depends on N and SEED, so that
+results can be compared between runs and gentoostats versions.
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import random
+
+ARCH = 'amd64'
+ARCHES = ( 'alpha', 'amd64', 'arm', 'hppa', 'ia64', 'ppc', 'ppc64', 's390'
+         , 'sh', 'sparc', 'x86'
+         )
+
+# Flags that are in USE without being in IUSE:
+IMPLICIT_USE = (ARCH, 'elibc_glibc', 'kernel_linux', 'userland_GNU')
+
+CATEGORIES = ( 'app-admin', 'app-arch', 'app-crypt', 'app-editors'
+             , 'app-misc', 'app-portage', 'app-text', 'dev-db', 'dev-lang'
+             , 'dev-libs', 'dev-perl', 'dev-python', 'dev-util', 'games-misc'
+             , 'gnome-base', 'kde-base', 'media-gfx', 'media-libs'
+             , 'media-sound', 'media-video', 'net-libs', 'net-misc'
+             , 'sci-libs', 'sys-apps', 'sys-devel', 'sys-fs', 'sys-kernel'
+             , 'sys-libs', 'virtual', 'www-client', 'x11-base', 'x11-libs'
+             , 'x11-misc', 'x11-wm'
+             )
+
+COMMON_FLAGS = ( 'X', 'acl', 'alsa', 'berkdb', 'bzip2', 'cairo', 'cups'
+               , 'dbus', 'debug', 'doc', 'examples', 'gif', 'gnome', 'gpm'
+               , 'gtk', 'ipv6', 'jpeg', 'kde', 'lzma', 'mp3', 'ncurses'
+               , 'nls', 'ogg', 'opengl', 'pam', 'pcre', 'perl', 'png'
+               , 'python', 'qt4', 'readline', 'sdl', 'selinux', 'ssl'
+               , 'static-libs', 'svg', 'tcpd', 'test', 'threads', 'tiff'
+               , 'truetype', 'udev', 'unicode', 'vim-syntax', 'vorbis'
+               , 'xml', 'zlib'
+               )
+
+# Package specific flags (e.g. 'foo-feature3'), as found in most IUSEs:
+LOCAL_FLAGS_PER_PACKAGE = 3
+
+REPOSITORIES = (('gentoo', 0.95), ('sunrise', 0.03), ('local', 0.02))
+
+def weighted_choice(rng, choices):
+	x = rng.random()
+	for value, weight in choices:
+		x -= weight
+		if x < 0:
+			return value
+	return choices[-1][0]
+
+def zipf_sample(rng, population, k):
+	"""
+	Picks 'k' distinct items, favouring the ones at the front of 'population'.
+	"""
+
+	k = min(k, len(population))
+	picked = []
+	while len(picked) < k:
+		item = population[min(int(rng.paretovariate(1.0)) - 1, len(population) - 1)]
+		if item not in picked:
+			picked.append(item)
+	return picked
+
+def make_keywords(rng):
+	"""
+	Most packages are stable on ARCH, some are only keyworded ~ARCH and a few
+	are -* (e.g. binary packages).
+	"""
+
+	x = rng.random()
+	if x < 0.02:
+		return '-* %s' % ARCH
+
+	arches = sorted(rng.sample(ARCHES, rng.randint(2, len(ARCHES))))
+	if ARCH not in arches:
+		arches.append(ARCH)
+
+	unstable = x < 0.12
+	return ' '.join(('~' if unstable or (a != ARCH and rng.random() < 0.3) \
+			else '') + a for a in arches)
+
+def make_package(rng, index):
+	"""
+	Returns (cp, cpv, {vdb file: contents}) for the 'index'th package.
+	"""
+
+	category = CATEGORIES[index % len(CATEGORIES)]
+	name     = 'pkg%d' % index
+	version  = '%d.%d.%d' \
+			% (rng.randint(0, 5), rng.randint(0, 20), rng.randint(0, 9))
+	if rng.random() < 0.2:
+		version += '-r%d' % rng.randint(1, 4)
+
+	pf = '%s-%s' % (name, version)
+
+	# Sizes of IUSE are roughly geometric, with a few packages having a lot:
+	iuse_size = min(int(rng.expovariate(1 / 7.0)), 60)
+	iuse = zipf_sample(rng, COMMON_FLAGS, iuse_size)
+	for i in range(rng.randint(0, LOCAL_FLAGS_PER_PACKAGE)):
+		iuse.append('%s-feature%d' % (name, i))
+	rng.shuffle(iuse)
+
+	iuse_entries = [('+' if rng.random() < 0.2 else '') + flag for flag in iuse]
+	use = [flag for flag in iuse if rng.random() < 0.45] + list(IMPLICIT_USE)
+
+	pkguse = ''
+	if iuse and rng.random() < 0.05:
+		pkguse = ' '.join(('-' if rng.random() < 0.5 else '') + flag \
+				for flag in rng.sample(iuse, min(2, len(iuse))))
+
+	files = { 'CATEGORY':   category
+	        , 'PF':         pf
+	        , 'SLOT':       '0'
+	        , 'EAPI':       rng.choice(('4', '5', '5'))
+	        , 'COUNTER':    str(1000 + index)
+	        , 'repository': weighted_choice(rng, REPOSITORIES)
+	        , 'BUILD_TIME': str(1293840000 + rng.randint(0, 2 * 365 * 86400))
+	        , 'SIZE':       str(int(rng.lognormvariate(13, 2)))
+	        , 'IUSE':       ' '.join(iuse_entries)
+	        , 'USE':        ' '.join(use)
+	        , 'PKGUSE':     pkguse
+	        , 'KEYWORDS':   make_keywords(rng)
+	        , 'CONTENTS':   ''
+	        }
+
+	return '%s/%s' % (category, name), '%s/%s' % (category, pf), files
+
+MAKE_CONF = '''\
+CFLAGS="-O2 -pipe -march=native"
+CXXFLAGS="${CFLAGS}"
+CHOST="x86_64-pc-linux-gnu"
+MAKEOPTS="-j4"
+USE="X alsa dbus ipv6 ssl unicode -kde"
+FEATURES="parallel-fetch sandbox"
+GENTOO_MIRRORS="http://distfiles.gentoo.org"
+SYNC="rsync://rsync.gentoo.org/gentoo-portage"
+PORTDIR="%(root)s/usr/portage"
+LANG="en_US.UTF-8"
+'''
+
+MAKE_DEFAULTS = '''\
+ARCH="%(arch)s"
+ACCEPT_KEYWORDS="%(arch)s"
+CHOST="x86_64-pc-linux-gnu"
+ELIBC="glibc"
+KERNEL="linux"
+USERLAND="GNU"
+USE_EXPAND="ELIBC KERNEL USERLAND"
+'''
+
+def write_file(root, path, contents):
+	path = os.path.join(root, path)
+	directory = os.path.dirname(path)
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	with io.open(path, 'w', encoding='utf_8') as f:
+		f.write(type(u'')(contents))
+
+def make_root(root, n, seed=0):
+	"""
+	Creates the synthetic root 'root' with 'n' installed packages. 'root'
+	should not exist yet.
+	"""
+
+	root = os.path.abspath(root)
+	rng  = random.Random(seed * 1000003 + n)
+
+	profile = os.path.join('usr', 'portage', 'profiles', 'bench')
+	write_file(root, os.path.join(profile, 'make.defaults'), \
+			MAKE_DEFAULTS % {'arch': ARCH})
+	write_file(root, os.path.join(profile, 'eapi'), '5\n')
+	write_file(root, 'usr/portage/profiles/repo_name', 'gentoo\n')
+	write_file(root, 'usr/portage/metadata/timestamp.chk', \
+			'Sat, 01 Sep 2012 00:00:01 +0000\n')
+
+	write_file(root, 'etc/portage/make.conf', MAKE_CONF % {'root': root})
+	os.symlink( os.path.join('..', '..', profile)
+	          , os.path.join(root, 'etc', 'portage', 'make.profile')
+	)
+
+	write_file(root, 'etc/gentoostats/auth.cfg', \
+			'[AUTH]\nUUID = bench\nPASSWD = bench\n')
+	# Options that aren't mentioned are enabled:
+	write_file(root, 'etc/gentoostats/payload.cfg', '[ENV]\n\n[PACKAGES]\n')
+
+	world = []
+	for index in range(n):
+		cp, cpv, files = make_package(rng, index)
+		for name, contents in files.items():
+			write_file(root, os.path.join('var', 'db', 'pkg', cpv, name), \
+					contents + '\n' if contents else '')
+
+		if rng.random() < 0.1:
+			world.append(cp)
+
+	write_file(root, 'var/lib/portage/world', \
+			''.join(a + '\n' for a in sorted(world)))
+	write_file(root, 'var/lib/portage/world_sets', '')
+
+	return root
+
+def main(args):
+	if len(args) not in (2, 3):
+		print(__doc__.strip(), file=sys.stderr)
+		return 1
+
+	seed = int(args[2]) if len(args) == 3 else 0
+	make_root(args[0], int(args[1]), seed)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+End-to-end benchmark of gentoostats on synthetic roots (see mkroot.py).
+
+Every stage of a submission is timed separately, at several numbers of
+installed packages, and the results are written as JSON so that they can be
+compared between versions (see --baseline).
+
+Each measurement runs in a fresh interpreter with ROOT and PORTAGE_CONFIGROOT
+pointing at the synthetic root, so that portage's caches don't carry over.
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+import mkroot
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYM_DIR   = os.path.join(os.path.dirname(BENCH_DIR), 'pym')
+
+UPLOAD_URL = '/upload/'
+
+RESULTS_FORMAT = 1
+
+# In the order in which they are run:
+STAGES = ( 'environment'
+         , 'installed_cpvs'
+         , 'analyse_packages'
+         , 'analyse_packages_cached'
+         , 'get_set'
+         , 'serialize'
+         , 'upload'
+         , 'upload_compressed'
+         )
+
+def get_peak_rss():
+	"""
+	Returns the peak resident set size of this process so far, in KiB.
+	"""
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		# In bytes rather than KiB:
+		peak //= 1024
+	return peak
+
+def timed(results, stage, func, *args):
+	"""
+	Calls func(*args), recording its wall and CPU time, and the peak RSS of
+	the process once it has returned, in results[stage].
+	"""
+
+	wall = time.time()
+	cpu  = sum(os.times()[:2])
+
+	value = func(*args)
+
+	results[stage] = { 'wall':     time.time() - wall
+	                 , 'cpu':      sum(os.times()[:2]) - cpu
+	                 , 'peak_rss': get_peak_rss()
+	                 }
+	return value
+
+def run_stages(root, server, jobs):
+	"""
+	Runs every stage once against 'root' (which must also be portage's ROOT)
+	and returns {stage: {'wall': seconds, 'cpu': seconds, 'peak_rss': KiB},
+	...}. The peak RSS never decreases from one stage to the next, as it is
+	that of the whole run so far.
+	"""
+
+	from gentoostats import util
+	from gentoostats.fields import ENV_VAR_FIELDS, ENV_LIST_FIELDS
+	from gentoostats.environment import Environment
+	from gentoostats.packages import Packages
+	from gentoostats.payload import Payload
+	from gentoostats.compression import default_codec
+	from gentoostats.modules.submit import Submit
+
+	config_dir  = os.path.join(root, 'etc', 'gentoostats')
+	payload_cfg = os.path.join(config_dir, 'payload.cfg')
+	auth_cfg    = os.path.join(config_dir, 'auth.cfg')
+
+	results = dict()
+
+	def environment():
+		env = Environment()
+		return [env.get_platform(), env.get_last_sync(), env.get_profile()] \
+				+ [env.get_var(var) for var in ENV_VAR_FIELDS + ENV_LIST_FIELDS]
+
+	timed(results, 'environment', environment)
+	timed(results, 'installed_cpvs', \
+			lambda: list(Packages.get_installed_CPVs()))
+
+	payload = Payload(payload_cfg, auth_cfg, jobs=jobs)
+	timed(results, 'analyse_packages', payload.analyse_packages)
+
+	cache_dir = tempfile.mkdtemp(prefix='gentoostats-bench-')
+	try:
+		Payload(payload_cfg, auth_cfg, jobs=jobs, cache_dir=cache_dir) \
+				.analyse_packages()
+		cached = Payload(payload_cfg, auth_cfg, jobs=jobs, cache_dir=cache_dir)
+		timed(results, 'analyse_packages_cached', cached.analyse_packages)
+	finally:
+		shutil.rmtree(cache_dir)
+
+	timed(results, 'get_set', Packages.get_set, 'world')
+
+	payload.generate_payload()
+	report = payload.get()
+	body = timed(results, 'serialize', util.serialize, report, False)
+
+	stages = (('upload', 'none'), ('upload_compressed', default_codec()))
+	for stage, codec in stages:
+		submit = Submit(dict( server   = server
+		                    , url      = UPLOAD_URL
+		                    , ssl      = False
+		                    , compress = codec
+		                    , verbose  = 0
+		                    , indent   = 2
+		                    , indent_c = 28
+		))
+		status, reason, _ = timed(results, stage, submit.upload, body)
+		if status != 200:
+			raise RuntimeError('Upload failed: %s (%s)' % (status, reason))
+
+	return { 'packages':      len(report.get('PACKAGES', {}))
+	       , 'payload_bytes': len(body.encode('utf_8') \
+	                              if isinstance(body, type(u'')) else body)
+	       , 'peak_rss':      get_peak_rss()
+	       , 'stages':        results
+	       }
+
+def start_server():
+	"""
+	Starts the receive module's server on a free local port, in a background
+	thread. Returns the server and its 'host:port'.
+	"""
+
+	if PYM_DIR not in sys.path:
+		sys.path.insert(0, PYM_DIR)
+	from gentoostats.modules.receive import ReceiveServer, ReportStore
+
+	server = ReceiveServer(('127.0.0.1', 0), UPLOAD_URL, ReportStore(), verbose=0)
+
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+
+	return server, '%s:%d' % server.server_address[:2]
+
+def run_child(python, root, server, jobs):
+	"""
+	Runs run_stages() in a new 'python' process.
+	"""
+
+	env = dict(os.environ)
+	env['ROOT'] = env['PORTAGE_CONFIGROOT'] = root + os.sep
+	env['PYTHONPATH'] = os.pathsep.join(
+			[PYM_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+
+	command = [ python, os.path.abspath(__file__)
+	          , '--child', root, '--server', server, '--jobs', str(jobs)
+	          ]
+	output = subprocess.check_output(command, env=env)
+	return json.loads(output.decode('utf_8').splitlines()[-1])
+
+def best_of(runs):
+	"""
+	Merges repeated measurements, keeping the fastest (by wall time) run of
+	each stage, and the lowest peak RSS.
+	"""
+
+	merged = dict(runs[0])
+	merged['peak_rss'] = min(run['peak_rss'] for run in runs)
+	merged['stages'] = dict()
+	for stage in runs[0]['stages']:
+		merged['stages'][stage] = min((run['stages'][stage] for run in runs), \
+				key=lambda timing: timing['wall'])
+
+	return merged
+
+def get_version():
+	try:
+		output = subprocess.check_output(
+			['git', 'describe', '--always', '--dirty'],
+			cwd=BENCH_DIR, stderr=open(os.devnull, 'w')
+		)
+		return output.decode('utf_8').strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def format_cell(value, base, fmt):
+	cell = fmt(value)
+
+	try:
+		cell += ' %+.0f%%' % (100.0 * (value - base) / base)
+	except (TypeError, ZeroDivisionError):
+		pass
+
+	return cell
+
+def get_measurement(results, n, stage, key):
+	try:
+		return results['sizes'][n]['stages'][stage][key]
+	except (TypeError, KeyError):
+		return None
+
+def print_table(results, baseline=None):
+	sizes = sorted(results['sizes'], key=int)
+
+	tables = ( ('stage (wall time)', 'wall',     lambda s: '%.3fs' % s)
+	         , ('peak RSS so far',   'peak_rss', lambda k: '%.1fM' % (k / 1024.0))
+	         )
+
+	for title, key, fmt in tables:
+		header = '%-24s' % title + ''.join('%14s' % ('%s pkgs' % n) for n in sizes)
+		print(header)
+		print('-' * len(header))
+
+		for stage in STAGES:
+			row = '%-24s' % stage
+			for n in sizes:
+				value = get_measurement(results, n, stage, key)
+				base  = get_measurement(baseline, n, stage, key)
+				cell = format_cell(value, base, fmt) if value is not None else '-'
+				row += '%14s' % cell
+			print(row)
+
+		if key == 'wall':
+			print('')
+
+def main(args):
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+	parser.add_argument( '-s', '--sizes'
+	                   , default='100,1000,10000'
+	                   , help="Comma-separated numbers of packages "
+	                          "(default: %(default)s)"
+	)
+	parser.add_argument( '-r', '--repeat'
+	                   , type=int
+	                   , default=3
+	                   , help="Runs per size; the fastest is kept "
+	                          "(default: %(default)s)"
+	)
+	parser.add_argument( '-j', '--jobs'
+	                   , type=int
+	                   , default=1
+	                   , help="Passed to Payload (default: %(default)s)"
+	)
+	parser.add_argument( '-o', '--output'
+	                   , default='bench.json'
+	                   , help="Where to write the results (default: %(default)s)"
+	)
+	parser.add_argument( '-b', '--baseline'
+	                   , help="Results of an earlier run to compare against"
+	)
+	parser.add_argument( '-w', '--workdir'
+	                   , help="Where to create the synthetic roots "
+	                          "(default: a temporary directory)"
+	)
+	parser.add_argument( '--keep'
+	                   , action='store_true'
+	                   , help="Keep the synthetic roots (reused by later runs "
+	                          "with the same --workdir)"
+	)
+	parser.add_argument( '--python'
+	                   , default=sys.executable
+	                   , help="Interpreter to benchmark (default: %(default)s)"
+	)
+	parser.add_argument('--child', help=argparse.SUPPRESS)
+	parser.add_argument('--server', help=argparse.SUPPRESS)
+
+	args = parser.parse_args(args)
+
+	if args.child:
+		print(json.dumps(run_stages(args.child, args.server, args.jobs)))
+		return 0
+
+	baseline = None
+	if args.baseline:
+		with io.open(args.baseline, encoding='utf_8') as f:
+			baseline = json.load(f)
+
+	workdir = args.workdir or tempfile.mkdtemp(prefix='gentoostats-bench-')
+	sizes   = [int(n) for n in args.sizes.split(',')]
+
+	results = { 'format':   RESULTS_FORMAT
+	          , 'version':  get_version()
+	          , 'python':   platform.python_version()
+	          , 'platform': platform.platform()
+	          , 'date':     time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+	          , 'jobs':     args.jobs
+	          , 'repeat':   args.repeat
+	          , 'sizes':    dict()
+	          }
+
+	server, address = start_server()
+	try:
+		for n in sizes:
+			root = os.path.join(workdir, str(n))
+			if not os.path.isdir(root):
+				print('Generating %d packages in %s...' % (n, root), file=sys.stderr)
+				mkroot.make_root(root, n)
+
+			print('Running %d x %d packages...' % (args.repeat, n), file=sys.stderr)
+			runs = [run_child(args.python, root, address, args.jobs) \
+					for _ in range(args.repeat)]
+			results['sizes'][str(n)] = best_of(runs)
+
+			if not args.keep:
+				shutil.rmtree(root)
+	finally:
+		server.shutdown()
+		server.server_close()
+		if not args.keep and not args.workdir:
+			shutil.rmtree(workdir, ignore_errors=True)
+
+	with io.open(args.output, 'w', encoding='utf_8') as f:
+		f.write(type(u'')(json.dumps(results, indent=2, sort_keys=True, \
+				separators=(',', ': '))))
+		f.write(u'\n')
+
+	print_table(results, baseline)
+	print('\nResults written to %s' % args.output)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
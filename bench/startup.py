@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Startup benchmark of the gentoostats command line.
+
+Times commands that do little besides starting up (printing the version or a
+help message), each in a fresh interpreter, and counts the modules that
+importing gentoostats loads. Results are written as JSON and can be compared
+between versions (see --baseline).
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+from run import BENCH_DIR, PYM_DIR, get_version
+
+SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), 'bin', 'gentoostats')
+
+RESULTS_FORMAT = 1
+
+# (name, arguments), in the order they are run:
+COMMANDS = ( ('version',     ['-V'])
+           , ('help',        ['--help'])
+           , ('submit_help', ['-h', 'submit'])
+           )
+
+COUNT_MODULES = "import sys, gentoostats; print(len(sys.modules))"
+
+def get_env():
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join(
+			[PYM_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+	return env
+
+def time_command(python, args, repeat):
+	"""
+	Runs 'python SCRIPT args' 'repeat' times and returns the sorted wall
+	times.
+	"""
+
+	env  = get_env()
+	null = open(os.devnull, 'w')
+
+	times = []
+	for _ in range(repeat):
+		start = time.time()
+		subprocess.check_call([python, SCRIPT] + args, env=env, stdout=null)
+		times.append(time.time() - start)
+
+	return sorted(times)
+
+def count_modules(python):
+	output = subprocess.check_output([python, '-c', COUNT_MODULES], env=get_env())
+	return int(output.decode('utf_8').split()[-1])
+
+def main(args):
+	parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+	parser.add_argument( '-r', '--repeat'
+	                   , type=int
+	                   , default=10
+	                   , help="Runs per command (default: %(default)s)"
+	)
+	parser.add_argument( '-o', '--output'
+	                   , default='startup.json'
+	                   , help="Where to write the results (default: %(default)s)"
+	)
+	parser.add_argument( '-b', '--baseline'
+	                   , help="Results of an earlier run to compare against"
+	)
+	parser.add_argument( '--python'
+	                   , default=sys.executable
+	                   , help="Interpreter to benchmark (default: %(default)s)"
+	)
+
+	args = parser.parse_args(args)
+
+	baseline = None
+	if args.baseline:
+		with io.open(args.baseline, encoding='utf_8') as f:
+			baseline = json.load(f)
+
+	results = { 'format':   RESULTS_FORMAT
+	          , 'version':  get_version()
+	          , 'python':   platform.python_version()
+	          , 'platform': platform.platform()
+	          , 'date':     time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+	          , 'repeat':   args.repeat
+	          , 'modules':  count_modules(args.python)
+	          , 'commands': dict()
+	          }
+
+	for name, command in COMMANDS:
+		times = time_command(args.python, command, args.repeat)
+		results['commands'][name] = { 'min':    times[0]
+		                            , 'median': times[len(times) // 2]
+		                            }
+
+	with io.open(args.output, 'w', encoding='utf_8') as f:
+		f.write(type(u'')(json.dumps(results, indent=2, sort_keys=True, \
+				separators=(',', ': '))))
+		f.write(u'\n')
+
+	print('%-24s %12s %12s' % ('command', 'min', 'median'))
+	for name, _ in COMMANDS:
+		row = '%-24s' % name
+		for stat in ('min', 'median'):
+			value = results['commands'][name][stat]
+			cell  = '%.0fms' % (1000 * value)
+
+			try:
+				base = baseline['commands'][name][stat]
+				cell += ' %+.0f%%' % (100.0 * (value - base) / base)
+			except (TypeError, KeyError, ZeroDivisionError):
+				pass
+
+			row += '%12s' % cell
+		print(row)
+
+	print('%-24s %12d' % ('modules imported', results['modules']), end='')
+	if baseline and 'modules' in baseline:
+		print(' (was %d)' % baseline['modules'], end='')
+	print('\n\nResults written to %s' % args.output)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -20,18 +20,13 @@ __authors__     = ('Vikraman Choudhury <vikraman.choudhury@gmail.com>, 2011',
 
 import __builtin__
 
-import os
 import sys
-import pkgutil
 
-import gentoolkit
+from . import timing
 from .config import Config
 from .app_util import *
 from .argument_parser_wrapper import ArgumentParserWrapper
-
-# Add ./modules/ to the current Python path:
-sys.path.append(os.path.join(os.path.dirname(__file__), 'modules'))
-import modules
+from .modules import MODULES
 
 # make an exportable copy of the __info__ variables:
 MODULE_META = get_module_meta(locals())
@@ -46,14 +41,8 @@ APP_DEFAULT_CONFIG = dict(
 NAME_MAP = {}
 FORMATTED_OPTIONS = []
 
-# Dynamically build the modules list:
-for _, name, _ in pkgutil.iter_modules(modules.__path__):
-	loaded_module = __import__(
-		name, globals(), locals(), ['MODULE_INFO'], -1
-	)
-
-	command, name, desc = loaded_module.MODULE_INFO
-
+# Modules are only imported when they are run:
+for command, name, desc in MODULES:
 	NAME_MAP[command] = name
 	FORMATTED_OPTIONS.append((bold_out_command(command, name), desc))
 
@@ -89,6 +78,14 @@ def set_args(parser):
 	                   , action='store_true'
 	                   , help="Display version info"
 	)
+	parser.add_argument( '--timings'
+	                   , action='store_true'
+	                   , help="Print the time spent in each phase"
+	)
+	parser.add_argument( '--profile'
+	                   , metavar="FILE"
+	                   , help="Write cProfile (pstats) data to FILE"
+	)
 	parser.add_argument( '--debug'
 	                   , action='store_true'
 	                   , ignore_in_desc=True
@@ -102,8 +99,8 @@ def set_args(parser):
 def main(args):
 	"""Parse input and run the program."""
 
-	gentoolkit.base.initialize_configuration()
-
+	# gentoolkit (and portage) is only loaded when something needs it, see
+	# app_util.load_gentoolkit().
 	config = Config()
 	config.update(APP_DEFAULT_CONFIG)
 
@@ -120,6 +117,7 @@ def main(args):
 
 	global_args, module_args = arg_parser.parse_known_args(args)
 	config.hard_update(vars(global_args))
+	propagate_config_to_gentoolkit(config)
 
 	# Normally argparse takes care of --help and prints a help message if
 	# -h/--help is present in args. However, I want to be able to print the
@@ -129,6 +127,10 @@ def main(args):
 		arg_parser.print_help(with_description=True)
 		return 0
 
+	if config.version:
+		print_version(MODULE_META)
+		return 0
+
 	if not config.module:
 		arg_parser.print_help(with_description=False)
 		return 2
@@ -143,13 +145,7 @@ def main(args):
 		else:
 			config.verbose = 0
 
-	propagate_config_to_gentoolkit(config)
-
-	if config.version:
-		gentoolkit.base.print_version(MODULE_META)
-		return 0
-
-	module_name = config.module[0]
+	module_name = config.module
 
 	if module_name == 'help':
 		arg_parser.print_help(with_description=True)
@@ -161,10 +157,39 @@ def main(args):
 		arg_parser.error("Unknown module '%s'" % module_name)
 
 	loaded_module = __import__(
-		expanded_module_name, globals(), locals(), [], -1
+		'gentoostats.modules.' + expanded_module_name, fromlist=['main']
 	)
 
-	return loaded_module.main(module_args, config)
+	return run_module(loaded_module, module_args, config)
+
+def run_module(loaded_module, module_args, config):
+	"""
+	Runs 'loaded_module', honouring --timings and --profile.
+	"""
+
+	if not config.timings and not config.profile:
+		return loaded_module.main(module_args, config)
+
+	recorder = timing.enable() if config.timings else None
+
+	profiler = None
+	if config.profile:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	try:
+		with timing.phase('total'):
+			return loaded_module.main(module_args, config)
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			profiler.dump_stats(config.profile)
+			print("Profile written to '%s'" % config.profile, file=sys.stderr)
+
+		if recorder is not None:
+			print('', file=sys.stderr)
+			recorder.print_summary()
 
 if __name__ == "__main__":
 	sys.exit(main(sys.argv[1:]))
@@ -9,8 +9,12 @@
 
 from __future__ import print_function
 
-import gentoolkit
-from gentoolkit.textwrap_ import TextWrapper
+import sys
+
+# The global options, which gentoolkit is configured with once it is loaded
+# (see load_gentoolkit()):
+_app_config = None
+_gentoolkit_loaded = False
 
 def expand_module_name(name_map, module_name):
 	"""Returns one of the values of 'name_map' or raises KeyError"""
@@ -65,9 +69,20 @@ def get_module_meta(locals_):
 
 	return result
 
+def print_version(module_meta):
+	"""
+	Prints the version info, like gentoolkit.base.print_version() but without
+	loading gentoolkit.
+	"""
+
+	print("%(__productname__)s (%(__version__)s) - %(__doc__)s" % module_meta)
+
 def format_options_respect_newline(options, indent_c=25):
 	"""Like format_options, but respects newlines."""
 
+	gentoolkit = load_gentoolkit()
+	from gentoolkit.textwrap_ import TextWrapper
+
 	wrapper = TextWrapper(width=gentoolkit.CONFIG['termWidth'])
 	result = []
 
@@ -82,11 +97,42 @@ def format_options_respect_newline(options, indent_c=25):
 
 	return '\n'.join(result)
 
+def load_gentoolkit():
+	"""
+	Imports gentoolkit (which imports portage) and configures it, the first
+	time something needs it, e.g. to print a help message. Returns the
+	gentoolkit package.
+	"""
+
+	global _gentoolkit_loaded
+
+	import gentoolkit
+	import gentoolkit.base
+	import gentoolkit.pprinter
+
+	if not _gentoolkit_loaded:
+		_gentoolkit_loaded = True
+		gentoolkit.base.initialize_configuration()
+		if _app_config is not None:
+			_propagate_config(gentoolkit, _app_config)
+
+	return gentoolkit
+
 def propagate_config_to_gentoolkit(config):
 	"""
+	Makes gentoolkit honour the global options in 'config', now if it has
+	been loaded, or else once it is.
+
 	@param config Config object
 	"""
 
+	global _app_config
+	_app_config = config
+
+	if _gentoolkit_loaded:
+		_propagate_config(sys.modules['gentoolkit'], config)
+
+def _propagate_config(gentoolkit, config):
 	if config.quiet:
 		gentoolkit.CONFIG['quiet'] = True
 
@@ -10,9 +10,7 @@ from __future__ import print_function
 import sys
 import argparse
 
-import gentoolkit
-from .app_util import format_options_respect_newline
-from gentoolkit.base import mod_usage, main_usage
+from .app_util import format_options_respect_newline, load_gentoolkit
 
 DEFAULT_OPT_INDENT = 2
 DEFAULT_COL_INDENT = 25
@@ -149,7 +147,7 @@ class ArgumentParserWrapper(object):
 			return message
 
 		message = _translate_message(message)
-		print(gentoolkit.pprinter.error(message), file=sys.stderr)
+		print(load_gentoolkit().pprinter.error(message), file=sys.stderr)
 		self.print_help(stream=sys.stderr)
 
 		self.exit(2)
@@ -208,6 +206,8 @@ class ArgumentParserWrapper(object):
 		Prints available arguments and their descriptions.
 		"""
 
+		gentoolkit = load_gentoolkit()
+
 		if self.is_app:
 			print(gentoolkit.pprinter.globaloption("global options"), file=stream)
 		else:
@@ -243,6 +243,9 @@ class ArgumentParserWrapper(object):
 		app/module.
 		"""
 
+		load_gentoolkit()
+		from gentoolkit.base import mod_usage, main_usage
+
 		if self.is_app:
 			print(main_usage(dict(__productname__=self.name)), file=stream)
 		else:
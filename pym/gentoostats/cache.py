@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Persistent cache of per-package payload records, and the journal of the
+changes reported by the portage hook since the cache was written. Also
+caches of the resolved package sets and of the ENV values.
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import json
+import time
+import hashlib
+
+try:
+	from urllib import quote
+except ImportError:
+	from urllib.parse import quote
+
+from .util import atomic_write
+
+DEFAULT_CACHE_DIR = '/var/cache/gentoostats'
+PACKAGE_CACHE_FILE = 'packages.json'
+JOURNAL_DIR = 'journal'
+SET_CACHE_FILE = 'sets.json'
+ENV_CACHE_FILE = 'env.json'
+
+# Bump this whenever the format of the cached records changes:
+CACHE_FORMAT = 4
+
+# Portage configuration (relative to PORTAGE_CONFIGROOT) that the cached
+# records depend on:
+CONFIG_PATHS = ( 'etc/make.conf'
+               , 'etc/portage/make.conf'
+               , 'etc/portage/package.use'
+               , 'etc/portage/package.accept_keywords'
+               , 'etc/portage/package.keywords'
+               , 'etc/portage/profile'
+               , 'etc/make.profile'
+               , 'etc/portage/make.profile'
+               )
+
+# What the package sets are read from, relative to EROOT:
+SET_STATE_PATHS = ( 'var/lib/portage/world'
+                  , 'var/lib/portage/world_sets'
+                  )
+# ... and relative to PORTAGE_CONFIGROOT:
+SET_CONFIG_PATHS = ( 'etc/portage/sets.conf'
+                   , 'etc/portage/sets'
+                   )
+
+# What the ENV values are read from (besides the environment, the kernel and
+# the portage tree), relative to PORTAGE_CONFIGROOT. The profiles are only
+# stat()ed, not walked:
+ENV_CONFIG_PATHS = ( 'etc/make.conf'
+                   , 'etc/portage/make.conf'
+                   , 'etc/portage/profile'
+                   , 'etc/portage/repos.conf'
+                   )
+ENV_PROFILE_PATHS = ( 'etc/make.profile'
+                    , 'etc/portage/make.profile'
+                    )
+# ... and in each profile of the stack:
+ENV_PROFILE_FILES = ( 'parent'
+                    , 'make.defaults'
+                    )
+
+def _stat(path):
+	"""
+	Returns a JSON-friendly description of the mtime and size of 'path'
+	(symlinks are followed, and their target is part of the description).
+	"""
+
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+
+	return [os.path.realpath(path), st.st_mtime, st.st_size]
+
+def _stat_tree(path):
+	"""
+	Like _stat(), but if 'path' is a directory, also describes everything
+	below it.
+	"""
+
+	result = _stat(path)
+	if result is None:
+		return None
+
+	if os.path.isdir(path):
+		for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+			dirnames.sort()
+			for name in sorted(filenames):
+				try:
+					st = os.stat(os.path.join(dirpath, name))
+				except OSError:
+					continue
+				result.append([os.path.join(dirpath, name), st.st_mtime, st.st_size])
+
+	return result
+
+def _stat_sync(settings):
+	"""
+	Like _stat(), for the time stamp of the last sync of the tree.
+	"""
+
+	return _stat(os.path.join(settings['PORTDIR'], 'metadata', 'timestamp.chk'))
+
+def config_fingerprint(settings, extra=None):
+	"""
+	Returns a hash of everything outside the vdb that affects a package's
+	record: the relevant portage configuration files, the profile, ARCH,
+	ACCEPT_KEYWORDS and the time stamp of the last sync (IUSE and the
+	profile's masked and forced flags come from the tree). 'extra' is any
+	other JSON-serialisable value to include (e.g. the list of reported
+	fields).
+	"""
+
+	config_root = settings['PORTAGE_CONFIGROOT'] or '/'
+	paths = [os.path.join(config_root, p) for p in CONFIG_PATHS]
+
+	data = dict(
+		format          = CACHE_FORMAT,
+		arch            = settings['ARCH'],
+		accept_keywords = settings['ACCEPT_KEYWORDS'],
+		paths           = [_stat_tree(p) for p in paths],
+		sync            = _stat_sync(settings),
+		extra           = extra,
+	)
+
+	encoded = json.dumps(data, sort_keys=True).encode('utf_8')
+	return hashlib.sha1(encoded).hexdigest()
+
+def sets_fingerprint(settings, set_names):
+	"""
+	Returns a hash of everything that the package sets 'set_names' are
+	resolved from: the world files, the user's and portage's set
+	configuration and the 'packages' files of the profile (for @system).
+	"""
+
+	# The rest of this module doesn't need portage:
+	from portage.const import GLOBAL_CONFIG_PATH
+
+	eroot       = settings['EROOT'] or '/'
+	config_root = settings['PORTAGE_CONFIGROOT'] or '/'
+
+	paths  = [os.path.join(eroot, p) for p in SET_STATE_PATHS]
+	paths += [os.path.join(config_root, p) for p in SET_CONFIG_PATHS]
+	paths += [os.path.join(GLOBAL_CONFIG_PATH, 'sets')]
+	paths += [os.path.join(p, 'packages') \
+			for p in getattr(settings, 'profiles', ())]
+
+	data = dict(
+		format = CACHE_FORMAT,
+		names  = sorted(set_names),
+		paths  = [_stat_tree(p) for p in paths],
+	)
+
+	encoded = json.dumps(data, sort_keys=True).encode('utf_8')
+	return hashlib.sha1(encoded).hexdigest()
+
+def env_fingerprint(settings, keys):
+	"""
+	Returns a cheap hash of everything that the ENV values 'keys' are
+	computed from: make.conf, /etc/portage/profile, repos.conf, where
+	make.profile points (and its mtime), the parent and make.defaults files
+	of every profile it inherits, the time stamp of the last sync, the kernel
+	(for PLATFORM) and the environment variables that override portage's
+	configuration.
+	"""
+
+	# The rest of this module doesn't need portage:
+	from portage.const import GLOBAL_CONFIG_PATH
+
+	config_root = settings['PORTAGE_CONFIGROOT'] or '/'
+
+	config  = [os.path.join(config_root, p) for p in ENV_CONFIG_PATHS]
+	config += [os.path.join(GLOBAL_CONFIG_PATH, 'repos.conf')]
+
+	profile  = [os.path.join(config_root, p) for p in ENV_PROFILE_PATHS]
+	profile += [os.path.join(p, name) for p in getattr(settings, 'profiles', ()) \
+			for name in ENV_PROFILE_FILES]
+
+	data = dict(
+		format  = CACHE_FORMAT,
+		keys    = sorted(keys),
+		config  = [_stat_tree(p) for p in config],
+		profile = [_stat(p) for p in profile],
+		sync    = _stat_sync(settings),
+		uname   = list(os.uname()),
+		environ = dict((k, os.environ.get(k)) for k in keys),
+	)
+
+	encoded = json.dumps(data, sort_keys=True).encode('utf_8')
+	return hashlib.sha1(encoded).hexdigest()
+
+def entry_key(path):
+	"""
+	Returns the cache key of the vdb directory 'path': its mtime and COUNTER.
+	Both change whenever the package is (re)merged.
+	"""
+
+	try:
+		mtime = os.stat(path).st_mtime
+	except OSError:
+		return None
+
+	try:
+		with io.open(os.path.join(path, 'COUNTER'), encoding='utf_8') as f:
+			counter = f.read().strip()
+	except (IOError, OSError):
+		counter = ''
+
+	return [mtime, counter]
+
+class PackageCache(object):
+	"""
+	A {cpv: record} cache stored as a single file. Each record is stored
+	along with the key of the vdb entry it was computed from, and the whole
+	cache is discarded when the configuration fingerprint changes.
+
+	The first line of the file is the header {'FORMAT': ..., 'FINGERPRINT':
+	...}, and each following line is the JSON [cpv, key] of a package, a tab
+	and the JSON record. The records are kept in memory as (UTF-8) JSON text,
+	which is much smaller than the decoded records, and only decoded when
+	they are looked up.
+	"""
+
+	def __init__(self, path, fingerprint):
+		"""
+		@param path Path to the cache file
+		@type  path str
+		@param fingerprint Fingerprint of the current configuration
+		@type  fingerprint str
+		"""
+
+		self.path        = path
+		self.fingerprint = fingerprint
+		self.keys        = dict()
+		self.records     = dict()
+		self.dirty       = False
+
+	def load(self):
+		"""
+		Loads the cache from disk. Returns False if there was no usable cache.
+		"""
+
+		try:
+			with io.open(self.path, encoding='utf_8') as f:
+				header = json.loads(f.readline())
+				if not isinstance(header, dict) \
+						or header.get('FORMAT') != CACHE_FORMAT \
+						or header.get('FINGERPRINT') != self.fingerprint:
+					self.dirty = True
+					return False
+
+				for line in f:
+					package, record = line.rstrip('\n').split('\t', 1)
+					cpv, key = json.loads(package)
+					self.keys[cpv]    = key
+					self.records[cpv] = record.encode('utf_8')
+		except (IOError, OSError, ValueError, TypeError):
+			# Don't keep part of a damaged cache:
+			self.keys    = dict()
+			self.records = dict()
+			self.dirty   = True
+			return False
+
+		return True
+
+	def get(self, cpv, key):
+		"""
+		Returns the cached record of 'cpv', or None if there's no record or it
+		was computed from a different vdb entry.
+		"""
+
+		if not self.has(cpv, key):
+			return None
+
+		return self.get_record(cpv)
+
+	def has(self, cpv, key):
+		"""
+		Returns True if there's a record of 'cpv' computed from the vdb entry
+		with the key 'key'.
+		"""
+
+		return key is not None and self.keys.get(cpv) == list(key)
+
+	def get_record(self, cpv):
+		"""
+		Returns the cached record of 'cpv', whatever vdb entry it was computed
+		from.
+		"""
+
+		return json.loads(self.records[cpv].decode('utf_8'))
+
+	def set(self, cpv, key, record):
+		self.keys[cpv]    = list(key) if key is not None else None
+		self.records[cpv] = json.dumps(record, separators=(',', ':')).encode('utf_8')
+		self.dirty = True
+
+	def remove(self, cpv):
+		if cpv in self.records:
+			del self.keys[cpv]
+			del self.records[cpv]
+			self.dirty = True
+
+	def prune(self, cpvs):
+		"""
+		Evicts the records of all packages not in 'cpvs'.
+		"""
+
+		cpvs = set(cpvs)
+		for cpv in list(self.records):
+			if cpv not in cpvs:
+				self.remove(cpv)
+
+	def _iter_lines(self):
+		header = {'FORMAT': CACHE_FORMAT, 'FINGERPRINT': self.fingerprint}
+		yield json.dumps(header, separators=(',', ':')).encode('utf_8') + b'\n'
+
+		for cpv in sorted(self.records):
+			package = json.dumps([cpv, self.keys[cpv]], separators=(',', ':'))
+			yield package.encode('utf_8') + b'\t' + self.records[cpv] + b'\n'
+
+	def save(self):
+		"""
+		Atomically writes the cache to disk (if it was modified). Returns False
+		if the cache couldn't be written.
+		"""
+
+		if not self.dirty:
+			return True
+
+		if not atomic_write(self.path, self._iter_lines()):
+			return False
+
+		self.dirty = False
+		return True
+
+class PackageJournal(object):
+	"""
+	The packages merged or unmerged since the package cache was written, as
+	recorded by the portage hook (see the hook module): one file per change,
+	so that recording one is cheap and never races with other merges. The
+	file names start with the time of the change, so that they sort in the
+	order the changes were made.
+	"""
+
+	def __init__(self, path):
+		"""
+		@param path Path to the journal directory
+		@type  path str
+		"""
+
+		self.path = path
+
+	def add(self, cpv, key, record, fingerprint):
+		"""
+		Records that 'cpv' was merged (and has the given 'record', computed
+		from the vdb entry with the given 'key' and under the configuration
+		'fingerprint') or, if 'record' is None, that it was unmerged (the key
+		and the fingerprint don't matter then). Returns False if the change
+		couldn't be written.
+		"""
+
+		name = '%017.6f-%d-%s.json' % (time.time(), os.getpid(), quote(cpv, safe=''))
+		data = { 'CPV':         cpv
+		       , 'KEY':         list(key) if key is not None else None
+		       , 'RECORD':      record
+		       , 'FINGERPRINT': fingerprint
+		       }
+
+		return atomic_write(os.path.join(self.path, name), \
+				json.dumps(data, separators=(',', ':')))
+
+	def get_names(self, before=None):
+		"""
+		Returns the sorted names of the recorded changes, or only of those
+		made before the time 'before'. Other files in the directory are
+		ignored (and so never discarded).
+		"""
+
+		try:
+			files = os.listdir(self.path)
+		except OSError:
+			return []
+
+		names = []
+		for name in files:
+			if not name.endswith('.json') or not name[:1].isdigit():
+				continue
+
+			try:
+				made = float(name.split('-', 1)[0])
+			except ValueError:
+				continue
+
+			if before is None or made < before:
+				names.append(name)
+
+		return sorted(names)
+
+	def read(self, name):
+		"""
+		Returns the change 'name' as a dictionary (see add()), or None if it
+		can't be read.
+		"""
+
+		try:
+			with io.open(os.path.join(self.path, name), encoding='utf_8') as f:
+				data = json.load(f)
+		except (IOError, OSError, ValueError):
+			return None
+
+		if not isinstance(data, dict) or not data.get('CPV'):
+			return None
+
+		return data
+
+	def discard(self, names):
+		"""
+		Deletes the changes 'names', once they are in the package cache.
+		"""
+
+		for name in names:
+			try:
+				os.unlink(os.path.join(self.path, name))
+			except OSError:
+				pass
+
+class ValueCache(object):
+	"""
+	A value (e.g. the resolved package sets) stored as a single JSON file
+	along with the fingerprint of what it was computed from.
+	"""
+
+	def __init__(self, path, fingerprint):
+		"""
+		@param path Path to the cache file
+		@type  path str
+		@param fingerprint E.g. sets_fingerprint() or env_fingerprint()
+		@type  fingerprint str
+		"""
+
+		self.path        = path
+		self.fingerprint = fingerprint
+
+	def load(self):
+		"""
+		Returns the cached value, or None if there is none or it is out of
+		date.
+		"""
+
+		try:
+			with io.open(self.path, encoding='utf_8') as f:
+				data = json.load(f)
+		except (IOError, OSError, ValueError):
+			return None
+
+		if not isinstance(data, dict) \
+				or data.get('FORMAT') != CACHE_FORMAT \
+				or data.get('FINGERPRINT') != self.fingerprint:
+			return None
+
+		return data.get('VALUE')
+
+	def save(self, value):
+		"""
+		Atomically writes 'value' to disk. Returns False if it couldn't be
+		written.
+		"""
+
+		data = { 'FORMAT':      CACHE_FORMAT
+		       , 'FINGERPRINT': self.fingerprint
+		       , 'VALUE':       value
+		       }
+
+		return atomic_write(self.path, json.dumps(data, separators=(',', ':')))
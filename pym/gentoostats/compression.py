@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Request body compression.
+"""
+
+from __future__ import print_function
+
+try:
+	import zlib
+except ImportError:
+	zlib = None
+
+try:
+	import bz2
+except ImportError:
+	bz2 = None
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+# Codec name -> Content-Encoding, from the fastest to the slowest:
+CONTENT_ENCODINGS = ( ('gzip', 'gzip')
+                    , ('bz2',  'bzip2')
+                    , ('xz',   'xz')
+                    )
+
+def _codec_modules():
+	return {'gzip': zlib, 'bz2': bz2, 'xz': lzma}
+
+def available_codecs():
+	"""
+	Returns the names of the codecs that can be used on this system
+	(including 'none').
+	"""
+
+	modules = _codec_modules()
+	return ['none'] + [name for name, _ in CONTENT_ENCODINGS if modules[name]]
+
+def default_codec():
+	"""
+	Returns the fastest available codec.
+	"""
+
+	codecs = available_codecs()
+	if len(codecs) > 1:
+		return codecs[1]
+	return 'none'
+
+def get_content_encoding(codec):
+	"""
+	Returns the Content-Encoding for 'codec' (None for 'none').
+	"""
+
+	return dict(CONTENT_ENCODINGS).get(codec)
+
+class _NullCompressor(object):
+	def compress(self, data):
+		return data
+
+	def flush(self):
+		return b''
+
+def get_compressor(codec):
+	"""
+	Returns an incremental compressor object (with compress() and flush()
+	methods) for 'codec'.
+	"""
+
+	if codec == 'none':
+		return _NullCompressor()
+	elif codec == 'gzip':
+		# wbits=16+MAX_WBITS produces a gzip header and trailer:
+		return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	elif codec == 'bz2':
+		return bz2.BZ2Compressor()
+	elif codec == 'xz':
+		return lzma.LZMACompressor()
+
+	raise ValueError("Unknown codec '%s'" % codec)
+
+def compress(codec, data):
+	"""
+	Compresses the bytes 'data' with 'codec'.
+	"""
+
+	compressor = get_compressor(codec)
+	return compressor.compress(data) + compressor.flush()
+
+def decompress(content_encoding, data):
+	"""
+	Decompresses the bytes 'data' sent with the Content-Encoding
+	'content_encoding' (None for uncompressed data). Raises ValueError if the
+	encoding is unknown (or its codec unavailable) or the data is corrupt.
+	"""
+
+	if not content_encoding or content_encoding == 'identity':
+		return data
+
+	codecs = dict((encoding, name) for name, encoding in CONTENT_ENCODINGS)
+	module = _codec_modules().get(codecs.get(content_encoding))
+	if module is None:
+		raise ValueError("Unsupported Content-Encoding '%s'" % content_encoding)
+
+	try:
+		if module is zlib:
+			return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+		return module.decompress(data)
+	except Exception as e:
+		raise ValueError("Corrupt %s data: %s" % (content_encoding, e))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+from __future__ import print_function
+
+import os
+
+import portage
+from portage.const import VDB_PATH
+
+from .vdb import EntryDB
+
+class CollectionContext(object):
+	"""
+	Per-run state shared by all the Metadata objects: portage settings, the
+	vardb handle and a memoizing keyword analyser.
+	"""
+
+	def __init__(self, settings=None, trees=None, root=None):
+		"""
+		@param settings Portage config to use (default: portage.settings)
+		@type  settings portage.config
+		@param trees Portage trees for settings['EROOT'] (default: portage.db)
+		@type  trees dict
+		@param root The root given to for_root(), if any
+		@type  root str
+		"""
+
+		if settings is None:
+			settings = portage.settings
+		if trees is None:
+			trees = portage.db[settings['EROOT']]
+
+		self.root     = root
+		self.settings = settings
+		self.trees    = trees
+		self.vardb    = trees['vartree'].dbapi
+		self.vdb_path = os.path.join(settings['EROOT'], VDB_PATH)
+
+		self.arch            = settings['ARCH']
+		self.accept_keywords = settings['ACCEPT_KEYWORDS'].split()
+
+		# The analyser only ever sees the package being looked up:
+		self._keyword_db    = EntryDB()
+		self._keyword_cache = dict()
+		self._analyser      = None
+
+	@classmethod
+	def for_root(cls, root):
+		"""
+		Returns a context for the system installed in 'root' (e.g. a chroot
+		or a container), configured by its own /etc/portage, like
+		`emerge --root=root --config-root=root` would be.
+		"""
+
+		root  = os.path.join(os.path.realpath(root), '')
+		trees = portage.create_trees(config_root=root, target_root=root)
+
+		# Newer portage versions key the trees by EROOT:
+		eroot = getattr(trees, '_target_eroot', root)
+		root_trees = trees[eroot]
+
+		return cls(root_trees['vartree'].settings, root_trees, root=root)
+
+	@property
+	def analyser(self):
+		"""
+		The KeywordAnalyser, created the first time a keyword is looked up.
+		"""
+
+		if self._analyser is None:
+			# Imported here as gentoolkit.enalyze loads portage's trees:
+			from gentoolkit.enalyze.lib import KeywordAnalyser
+
+			self._analyser = KeywordAnalyser(
+				arch            = self.arch,
+				accept_keywords = self.accept_keywords,
+				vardb           = self._keyword_db,
+			)
+
+		return self._analyser
+
+	def _keyword_cache_key(self, keywords, use):
+		"""
+		The analyser only consults USE to find out which of the KEYWORDS (or
+		ARCH) the package was built for, so the rest of USE is irrelevant.
+		"""
+
+		candidates = set(k.lstrip('~-') for k in keywords.split())
+		candidates.add(self.arch)
+
+		used = tuple(sorted(flag for flag in use.split() if flag in candidates))
+		return (keywords, bool(use.strip()), used)
+
+	def get_keyword(self, cpv, entry=None):
+		"""
+		Returns the keyword used to install 'cpv'. 'entry' is a dict with the
+		package's KEYWORDS and USE (read from the vardb if not given).
+
+		Results are memoized, as most packages share a handful of KEYWORDS.
+		"""
+
+		if entry is None:
+			keywords, use = self.vardb.aux_get(cpv, ['KEYWORDS', 'USE'])
+			entry = {'KEYWORDS': keywords, 'USE': use}
+
+		key = self._keyword_cache_key(entry['KEYWORDS'], entry['USE'])
+
+		try:
+			return self._keyword_cache[key]
+		except KeyError:
+			pass
+
+		self._keyword_db.entries = {cpv: entry}
+		try:
+			keyword = self.analyser.get_inst_keyword_cpv(cpv)
+		finally:
+			self._keyword_db.entries = dict()
+
+		self._keyword_cache[key] = keyword
+		return keyword
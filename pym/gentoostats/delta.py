@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Delta submissions (protocol 3).
+
+A delta describes how to get from the last snapshot acknowledged by the server
+(the "base") to the current one:
+
+	{ 'PROTOCOL': 3
+	, 'AUTH':     {...}
+	, 'BASE':     <content_hash() of the base snapshot>
+	, 'HASH':     <content_hash() of the new snapshot>
+	, 'DELTA':    { 'PACKAGES': { 'ADDED':   {...}
+	                            , 'CHANGED': {...}
+	                            , 'REMOVED': [...]
+	                            }
+	              , 'ENV':      {'CHANGED': {...}, 'REMOVED': [...]}
+	              }
+	}
+
+'ENV' covers every top-level key other than PACKAGES (including WORLDSET).
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import json
+import tempfile
+
+from .util import content_hash
+from .protocol import DELTA_PROTOCOL
+
+# Keys that are not part of the reported data:
+NON_SNAPSHOT_KEYS = ('AUTH', 'PROTOCOL')
+
+def get_snapshot(payload):
+	"""
+	Returns the part of 'payload' that is compared between runs.
+	"""
+
+	return dict((k, v) for k, v in payload.items() if k not in NON_SNAPSHOT_KEYS)
+
+def _diff_dicts(base, current):
+	added   = dict((k, v) for k, v in current.items() if k not in base)
+	changed = dict((k, v) for k, v in current.items() \
+			if k in base and base[k] != v)
+	removed = sorted(k for k in base if k not in current)
+
+	return added, changed, removed
+
+def compute_delta(base, current):
+	"""
+	Returns the delta between the snapshots 'base' and 'current'.
+	"""
+
+	base_env    = dict((k, v) for k, v in base.items()    if k != 'PACKAGES')
+	current_env = dict((k, v) for k, v in current.items() if k != 'PACKAGES')
+
+	added, changed, removed = _diff_dicts(base_env, current_env)
+	changed.update(added)
+	env = {'CHANGED': changed, 'REMOVED': removed}
+
+	added, changed, removed = \
+			_diff_dicts(base.get('PACKAGES', {}), current.get('PACKAGES', {}))
+	packages = {'ADDED': added, 'CHANGED': changed, 'REMOVED': removed}
+
+	return {'ENV': env, 'PACKAGES': packages}
+
+def apply_delta(base, delta):
+	"""
+	Returns the snapshot obtained by applying 'delta' to 'base'.
+	"""
+
+	result = dict(base)
+	result['PACKAGES'] = dict(base.get('PACKAGES', {}))
+
+	env = delta.get('ENV', {})
+	for k in env.get('REMOVED', []):
+		result.pop(k, None)
+	result.update(env.get('CHANGED', {}))
+
+	packages = delta.get('PACKAGES', {})
+	for cpv in packages.get('REMOVED', []):
+		result['PACKAGES'].pop(cpv, None)
+	result['PACKAGES'].update(packages.get('ADDED', {}))
+	result['PACKAGES'].update(packages.get('CHANGED', {}))
+
+	if 'PACKAGES' not in base and not result['PACKAGES']:
+		del result['PACKAGES']
+
+	return result
+
+def make_delta_payload(payload, base):
+	"""
+	Returns the protocol 3 payload that turns the snapshot 'base' into
+	'payload'.
+	"""
+
+	current = get_snapshot(payload)
+
+	return { 'PROTOCOL': DELTA_PROTOCOL
+	       , 'AUTH':     payload['AUTH']
+	       , 'BASE':     content_hash(base)
+	       , 'HASH':     content_hash(current)
+	       , 'DELTA':    compute_delta(base, current)
+	       }
+
+class SnapshotWriter(object):
+	"""
+	Writes a snapshot incrementally, one package at a time. Nothing replaces
+	the stored snapshot until commit() is called.
+
+	The file format is one JSON value per line: first the header
+	{'KEYS': <snapshot without PACKAGES>, 'PACKAGES': <bool>}, then one
+	[cpv, package_info] pair per package.
+	"""
+
+	def __init__(self, path, payload, has_packages):
+		self.path = path
+		self.file = None
+
+		directory = os.path.dirname(path) or '.'
+		try:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+
+			fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+			os.chmod(self.tmp_path, 0o600)
+			self.file = os.fdopen(fd, 'wb')
+		except (IOError, OSError):
+			self.file = None
+			return
+
+		keys = get_snapshot(payload)
+		keys.pop('PACKAGES', None)
+		self._write({'KEYS': keys, 'PACKAGES': has_packages})
+
+	def _write(self, value):
+		if self.file is None:
+			return
+
+		try:
+			self.file.write(json.dumps(value, separators=(',', ':')).encode('utf_8'))
+			self.file.write(b'\n')
+		except (IOError, OSError):
+			self.abort()
+
+	def add(self, cpv, package_info):
+		self._write([cpv, package_info])
+
+	def commit(self):
+		"""
+		Replaces the stored snapshot. Returns False on error.
+		"""
+
+		if self.file is None:
+			return False
+
+		try:
+			self.file.close()
+			self.file = None
+			os.rename(self.tmp_path, self.path)
+		except (IOError, OSError):
+			self.abort()
+			return False
+
+		return True
+
+	def abort(self):
+		if self.file is not None:
+			try:
+				self.file.close()
+			except (IOError, OSError):
+				pass
+			self.file = None
+
+		try:
+			os.unlink(self.tmp_path)
+		except (AttributeError, OSError):
+			pass
+
+class SnapshotStore(object):
+	"""
+	Keeps the last snapshot that was acknowledged by the server.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def load(self):
+		"""
+		Returns the stored snapshot, or None.
+		"""
+
+		try:
+			with io.open(self.path, encoding='utf_8') as f:
+				header = json.loads(f.readline())
+				snapshot = dict(header['KEYS'])
+
+				if header['PACKAGES']:
+					snapshot['PACKAGES'] = dict(json.loads(line) for line in f)
+		except (IOError, OSError, ValueError, KeyError, TypeError):
+			return None
+
+		return snapshot
+
+	def writer(self, payload, has_packages):
+		"""
+		Returns a SnapshotWriter for 'payload'. The caller must add() every
+		package to it.
+		"""
+
+		return SnapshotWriter(self.path, payload, has_packages)
+
+	def save(self, payload):
+		"""
+		Stores the snapshot of 'payload'. Returns False on error.
+		"""
+
+		writer   = self.writer(payload, 'PACKAGES' in payload)
+		packages = payload.get('PACKAGES', {})
+		for cpv in sorted(packages):
+			writer.add(cpv, packages[cpv])
+
+		return writer.commit()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Compact encoding of the PACKAGES section (protocol 4).
+
+Instead of {cpv: {field: value}}, a protocol 4 payload contains
+
+	'PACKAGES': { 'FIELDS':  ['REPO', 'SIZE', ...]
+	            , 'RECORDS': {cpv: [value, ...]}
+	            , 'STRINGS': ['gentoo', 'amd64', 'ssl', ...]
+	            }
+
+where each record holds the values of FIELDS in order:
+
+	* REPO and KEYWORD are indices into STRINGS.
+	* SIZE and BUILD_TIME are unchanged.
+	* IUSE is a list of indices into STRINGS.
+	* USE and PKGUSE are either a hex string, which is a bitset over the
+	  package's own IUSE (bit i set means IUSE[i] is in the list), or, if the
+	  list can't be expressed that way, a list of indices into STRINGS.
+
+STRINGS comes after RECORDS so that the encoder can stream the records.
+"""
+
+from __future__ import print_function
+
+from .util import StreamingDict
+from .protocol import COMPACT_PROTOCOL
+
+STRING_FIELDS  = ('REPO', 'KEYWORD')
+FLAG_FIELDS    = ('PKGUSE', 'USE')
+
+class StringTable(object):
+	"""
+	Assigns consecutive indices to strings.
+	"""
+
+	def __init__(self):
+		self.strings = []
+		self.indices = dict()
+
+	def index(self, s):
+		try:
+			return self.indices[s]
+		except KeyError:
+			self.indices[s] = len(self.strings)
+			self.strings.append(s)
+			return self.indices[s]
+
+def _encode_flags(flags, iuse, table):
+	"""
+	>>> _encode_flags(['a', 'c'], ['a', 'b', 'c'], StringTable())
+	'5'
+	>>> _encode_flags(['c', 'a'], ['a', 'b', 'c'], StringTable())
+	[0, 1]
+	>>> _encode_flags([], ['a'], StringTable())
+	'0'
+	"""
+
+	# A bitset only preserves the list if it is in IUSE order:
+	enabled = set(flags)
+	if len(enabled) == len(flags) and [f for f in iuse if f in enabled] == flags:
+		bits = 0
+		for i, flag in enumerate(iuse):
+			if flag in enabled:
+				bits |= 1 << i
+		return '%x' % bits
+
+	return [table.index(flag) for flag in flags]
+
+def _decode_flags(value, iuse, strings):
+	if isinstance(value, list):
+		return [strings[i] for i in value]
+
+	bits = int(value, 16)
+	return [flag for i, flag in enumerate(iuse) if bits & (1 << i)]
+
+def encode_record(package_info, fields, table):
+	"""
+	Returns the compact form of 'package_info' (a dict with 'fields').
+	"""
+
+	iuse = package_info.get('IUSE') or []
+
+	record = []
+	for field in fields:
+		value = package_info[field]
+
+		if field in STRING_FIELDS:
+			value = table.index(value)
+		elif field == 'IUSE':
+			value = [table.index(flag) for flag in value]
+		elif field in FLAG_FIELDS:
+			if 'IUSE' in fields:
+				value = _encode_flags(value, iuse, table)
+			else:
+				value = [table.index(flag) for flag in value]
+
+		record.append(value)
+
+	return record
+
+def decode_record(record, fields, strings):
+	"""
+	Reverses encode_record().
+	"""
+
+	values = dict(zip(fields, record))
+	iuse = [strings[i] for i in values.get('IUSE', [])]
+
+	package_info = dict()
+	for field, value in values.items():
+		if field in STRING_FIELDS:
+			value = strings[value]
+		elif field == 'IUSE':
+			value = iuse
+		elif field in FLAG_FIELDS:
+			value = _decode_flags(value, iuse, strings)
+
+		package_info[field] = value
+
+	return package_info
+
+def _iter_encoded_records(packages, fields, table):
+	for cpv, package_info in packages:
+		yield cpv, encode_record(package_info, fields, table)
+
+def _iter_packages_section(packages, fields):
+	table = StringTable()
+
+	yield 'FIELDS', list(fields)
+	yield 'RECORDS', StreamingDict(_iter_encoded_records(packages, fields, table))
+
+	# Only complete once all the records have been serialized:
+	yield 'STRINGS', table.strings
+
+def encode_packages(packages, fields):
+	"""
+	Returns the compact PACKAGES section for the (cpv, package_info) pairs
+	'packages' as a util.StreamingDict. 'fields' are the keys of each
+	package_info.
+	"""
+
+	return StreamingDict(_iter_packages_section(packages, fields))
+
+def decode_packages(section):
+	"""
+	Returns {cpv: package_info} for a compact PACKAGES section.
+	"""
+
+	fields  = section['FIELDS']
+	strings = section['STRINGS']
+
+	return dict((cpv, decode_record(record, fields, strings)) \
+			for cpv, record in section['RECORDS'].items())
+
+def decode_payload(payload):
+	"""
+	Returns a copy of 'payload' with a plain PACKAGES section. Payloads that
+	don't use the compact encoding are returned as they are.
+	"""
+
+	if payload.get('PROTOCOL') != COMPACT_PROTOCOL or 'PACKAGES' not in payload:
+		return payload
+
+	result = dict(payload)
+	result['PACKAGES'] = decode_packages(payload['PACKAGES'])
+	return result
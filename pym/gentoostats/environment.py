@@ -11,24 +11,28 @@ import os
 import platform
 
 import portage
-from _emerge.actions import relative_profile_path
 
 class Environment(object):
 	"""
 	A class encapsulating all environment and portage variable providers
 	"""
 
-	def __init__(self):
+	def __init__(self, settings=None):
 		"""
-		Initialize the class and portdir
+		Initialize the class and portdir. 'settings' is the portage config of
+		the system to report (default: portage.settings).
 		"""
-		self.portdir = portage.settings['PORTDIR']
+		if settings is None:
+			settings = portage.settings
+
+		self.settings = settings
+		self.portdir  = settings['PORTDIR']
 
 	def get_var(self, myvar):
 		"""
 		Return the value of a portage variable
 		"""
-		return portage.settings[myvar]
+		return self.settings[myvar]
 
 	def get_platform(self):
 		"""
@@ -49,7 +53,8 @@ class Environment(object):
 		except portage.exception.PortageException:
 			pass
 
-		if last_sync is None:
+		# grabfile() returns an empty list if there is no time stamp:
+		if not last_sync:
 			return 'Unknown'
 
 		return last_sync[0]
@@ -58,8 +63,11 @@ class Environment(object):
 		"""
 		Return selected portage profile
 		"""
+		# _emerge.actions is big, only import it when it's needed:
+		from _emerge.actions import relative_profile_path
+
 		profilever = None
-		profile = portage.settings.profile_path
+		profile = self.settings.profile_path
 		if profile:
 			profilever = relative_profile_path(self.portdir, profile)
 			if profilever is None:
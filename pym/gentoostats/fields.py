@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+The payload fields and the selection of fields enabled in payload.cfg.
+"""
+
+from __future__ import print_function
+
+from collections import namedtuple
+
+try:
+	import ConfigParser
+except ImportError:
+	import configparser as ConfigParser
+
+# Reported as they are:
+ENV_VAR_FIELDS = ( 'ARCH', 'CHOST', 'CTARGET', 'CFLAGS', 'CXXFLAGS', 'FFLAGS'
+                 , 'LDFLAGS', 'ACCEPT_LICENSE', 'MAKEOPTS'
+                 , 'EMERGE_DEFAULT_OPTS', 'PORTAGE_RSYNC_EXTRA_OPTS', 'SYNC'
+                 , 'LANG'
+                 )
+# Reported as lists:
+ENV_LIST_FIELDS = ('ACCEPT_KEYWORDS', 'GENTOO_MIRRORS', 'FEATURES', 'USE')
+
+ENV_FIELDS = ('PLATFORM', 'LASTSYNC', 'PROFILE') + ENV_VAR_FIELDS \
+		+ ENV_LIST_FIELDS
+
+USE_FLAG_TYPES = ('IUSE', 'PKGUSE', 'USE')
+PACKAGE_FIELDS = ('REPO', 'SIZE', 'KEYWORD', 'BUILD_TIME') + USE_FLAG_TYPES
+
+_FieldSelection = namedtuple('FieldSelection', ['env', 'packages', 'worldset'])
+
+class FieldSelection(_FieldSelection):
+	"""
+	The (immutable) set of fields to report:
+
+	env      -- enabled ENV_FIELDS
+	packages -- enabled PACKAGE_FIELDS, in that order
+	worldset -- whether WORLDSET is enabled
+	"""
+
+	__slots__ = ()
+
+	@classmethod
+	def from_config(cls, config_parser):
+		"""
+		Compiles the payload config. Fields that aren't mentioned are enabled.
+		Raises ValueError describing every malformed entry.
+		"""
+
+		errors  = []
+		enabled = dict()
+
+		sections = ( ('ENV',      ENV_FIELDS)
+		           , ('PACKAGES', PACKAGE_FIELDS + ('WORLDSET',))
+		           )
+
+		for section, keys in sections:
+			if not config_parser.has_section(section):
+				errors.append("missing section [%s]" % section)
+				continue
+
+			for key in keys:
+				try:
+					enabled[section, key] = config_parser.getboolean(section, key)
+				except ConfigParser.NoOptionError:
+					enabled[section, key] = True
+				except ValueError:
+					errors.append("%s/%s: '%s' is not a boolean" \
+							% (section, key, config_parser.get(section, key)))
+
+		if errors:
+			raise ValueError('; '.join(errors))
+
+		return cls(
+			env      = tuple(k for k in ENV_FIELDS if enabled['ENV', k]),
+			packages = tuple(k for k in PACKAGE_FIELDS if enabled['PACKAGES', k]),
+			worldset = enabled['PACKAGES', 'WORLDSET'],
+		)
+
+	def is_enabled(self, section, key):
+		if section == 'ENV':
+			return key in self.env
+		elif key == 'WORLDSET':
+			return self.worldset
+		else:
+			return key in self.packages
@@ -7,65 +7,115 @@
 
 from __future__ import print_function
 
-import portage
 import gentoolkit.flag
-from gentoolkit.dbapi import VARDB
-from gentoolkit.enalyze.lib import KeywordAnalyser
+
+from .context import CollectionContext
 
 class Metadata(object):
 	"""
 	A class encapsulating all package metadata
 	"""
 
-	def __init__(self, cpv):
+	def __init__(self, cpv, context=None, entry=None):
 		"""
-		Initialize the class with the cpv. All metadata are read from portage
+		Initialize the class with the cpv. All metadata are read from portage,
+		unless 'entry' (a dict produced by vdb.VDBReader) is given, in which
+		case no further vdb lookups are made. IUSE and USE come from
+		gentoolkit either way.
+
+		'context' is the CollectionContext of the current run. Pass one in when
+		creating more than one Metadata object.
+
+		Nothing is looked up until a getter asks for it, and every field is
+		computed at most once.
 		"""
-		self.repo, self.build_time, self.size = \
-				VARDB.aux_get(cpv, ['repository', 'BUILD_TIME', 'SIZE'])
+		if context is None:
+			context = CollectionContext()
+
+		self.cpv     = cpv
+		self.context = context
+		self.entry   = entry
+
+		self._values = dict()
+
+	def _get(self, name, compute):
+		try:
+			return self._values[name]
+		except KeyError:
+			value = self._values[name] = compute()
+			return value
+
+	def _aux_get(self, key):
+		if self.entry is not None:
+			return self.entry[key]
+		return self.context.vardb.aux_get(self.cpv, [key])[0]
+
+	def _compute_flags(self):
+		# IUSE is read from the tree and the final USE flags are filtered
+		# through the profile (masked, forced, USE_EXPAND_HIDDEN), so they
+		# can't be taken from the entry:
+		return gentoolkit.flag.get_flags(self.cpv, final_setting=True)
 
-		arch = portage.settings['ARCH']
-		accept_keywords = portage.settings['ACCEPT_KEYWORDS'].split()
-		ka = KeywordAnalyser(arch=arch, accept_keywords=accept_keywords)
-		self.keyword = ka.get_inst_keyword_cpv(cpv)
+	def _compute_pkguse(self):
+		# Like gentoolkit.flag.get_installed_use():
+		if self.entry is not None:
+			return self.entry['PKGUSE'].split()
+		return gentoolkit.flag.get_installed_use(self.cpv, use="PKGUSE")
 
-		self.iuse, self.use = \
-				gentoolkit.flag.get_flags(cpv, final_setting=True)
+	def _compute_keyword(self):
+		return self.context.get_keyword(self.cpv, self.entry)
 
-		self.pkguse = gentoolkit.flag.get_installed_use(cpv, use="PKGUSE")
+	def get_iuse(self):
+		"""
+		Returns the ebuild's [IUSE].
+		"""
+		return self._get('flags', self._compute_flags)[0]
+
+	def get_use(self):
+		"""
+		Returns the [final USE].
+		"""
+		return self._get('flags', self._compute_flags)[1]
+
+	def get_pkguse(self):
+		"""
+		Returns the user's [PKGUSE].
+		"""
+		return self._get('pkguse', self._compute_pkguse)
 
 	def get_use_flag_information(self):
 		"""
 		Returns [ebuild's IUSE], [user's PKGUSE], and [final USE].
 		"""
 
-		return { 'IUSE':   self.iuse
-		       , 'PKGUSE': self.pkguse
-		       , 'USE':    self.use
+		return { 'IUSE':   self.get_iuse()
+		       , 'PKGUSE': self.get_pkguse()
+		       , 'USE':    self.get_use()
 		       }
 
 	def get_keyword(self):
 		"""
 		Return keyword used to install package
 		"""
-		return self.keyword
+		return self._get('keyword', self._compute_keyword)
 
 	def get_repo_name(self):
 		"""
 		Return the repository the package was installed from
 		"""
-		if self.repo:
-			return self.repo
+		repo = self._get('repo', lambda: self._aux_get('repository'))
+		if repo:
+			return repo
 		return 'Unknown'
 
 	def get_build_time(self):
 		"""
 		Return the time package was built
 		"""
-		return self.build_time
+		return self._get('build_time', lambda: self._aux_get('BUILD_TIME'))
 
 	def get_size(self):
 		"""
 		Return the size of the installed package
 		"""
-		return self.size
+		return self._get('size', lambda: self._aux_get('SIZE'))
@@ -4,3 +4,21 @@
 # Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
 #
 # Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+The gentoostats modules.
+
+MODULES lists the MODULE_INFO of every module, so that they don't have to be
+imported (along with portage and everything else they use) just to build the
+help message or to find the one that was asked for.
+"""
+
+# (command, name, description), as in the MODULE_INFO of each module:
+MODULES = ( ('g', 'agent',     'submit statistics whenever the system changes')
+          , ('a', 'analyze',   'aggregate statistics from stored reports')
+          , ('c', 'configure', 'configure gentoostats')
+          , ('k', 'hook',      'record a merged or unmerged package '
+                               '(run by portage)')
+          , ('r', 'receive',   'receive reports locally (a test server)')
+          , ('s', 'submit',    'generate and submit statistics')
+          )
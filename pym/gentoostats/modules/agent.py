@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Keep running, and submit statistics whenever the system changes.
+
+The agent keeps the package records in memory and watches the vdb and the
+portage configuration, with inotify (through pyinotify) if it is available,
+or by polling otherwise. When a package is merged or unmerged, only its
+category is rescanned and only the changed packages are analysed again; a
+change in the configuration rebuilds everything. A report is submitted once
+nothing has changed for a while (--debounce), i.e. shortly after emerge has
+finished, and the submit module's options are used for it.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+try:
+	import pyinotify
+except ImportError:
+	pyinotify = None
+
+if pyinotify is not None:
+	# Entries added to or removed from a directory:
+	DIRECTORY_MASK = pyinotify.IN_CREATE | pyinotify.IN_DELETE \
+			| pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+	# ... or modified:
+	CONFIG_MASK = DIRECTORY_MASK | pyinotify.IN_CLOSE_WRITE
+
+from gentoostats import util
+from gentoostats.cache import PackageCache, PACKAGE_CACHE_FILE, CONFIG_PATHS, \
+		config_fingerprint, entry_key
+from gentoostats.config import Config
+from gentoostats.fields import FieldSelection
+from gentoostats.payload import Payload, iter_analyse_cpvs, \
+		iter_analyse_parallel
+from gentoostats.records import PackageRecords
+from gentoostats.context import CollectionContext
+from gentoostats.vdb import VDBReader
+from gentoostats.modules.submit import Submit, get_root_path, get_root_dir
+from gentoostats.argument_parser_wrapper import ArgumentParserWrapper
+
+MODULE_INFO = (
+	'g', 'agent', 'submit statistics whenever the system changes'
+)
+
+MODULE_DEFAULT_CONFIG = dict(
+	verbose       = 1,
+	debounce      = 60,
+	poll_interval = 300,
+	no_inotify    = False,
+)
+
+class PackageIndex(object):
+	"""
+	The records of the installed packages (packed, see
+	records.PackageRecords), kept up to date one vdb category at a time.
+	Also kept in the package cache (if 'cache' is given), so that a restarted
+	agent doesn't have to analyse everything again.
+	"""
+
+	def __init__(self, context, fields, jobs=1, cache=None):
+		self.context = context
+		self.fields  = fields
+		self.jobs    = jobs
+		self.cache   = cache
+		self.reader  = VDBReader(context.vdb_path)
+		self.keys    = dict()
+		self.records = PackageRecords(fields)
+
+		# (reused, recomputed) records of the last rescan():
+		self.cache_stats = (0, 0)
+
+	def rescan(self, categories=None):
+		"""
+		Brings the records of the packages in 'categories' (default: all) up
+		to date. Returns the number of packages that changed.
+		"""
+
+		keys = dict((cpv, entry_key(path)) \
+				for cpv, path in self.reader.iter_cpvs(categories))
+
+		removed = [cpv for cpv in self.keys if cpv not in keys and \
+				(categories is None or cpv.split('/')[0] in categories)]
+		for cpv in removed:
+			del self.keys[cpv]
+			self.records.remove(cpv)
+			if self.cache is not None:
+				self.cache.remove(cpv)
+
+		missing = []
+		for cpv, key in sorted(keys.items()):
+			if cpv in self.keys and self.keys[cpv] == key:
+				continue
+
+			record = self.cache.get(cpv, key) if self.cache is not None else None
+			if record is None:
+				missing.append(cpv)
+			else:
+				self.keys[cpv] = key
+				self.records.add(cpv, record)
+
+		if self.jobs > 1 and len(missing) > 1:
+			computed = iter_analyse_parallel(missing, self.fields, self.reader, \
+					self.jobs, self.context.root)
+		else:
+			computed = iter_analyse_cpvs(missing, self.fields, self.context, \
+					self.reader)
+
+		for cpv, record in computed:
+			self.keys[cpv] = keys[cpv]
+			self.records.add(cpv, record)
+			if self.cache is not None:
+				self.cache.set(cpv, keys[cpv], record)
+
+		if self.cache is not None:
+			self.cache.save()
+
+		self.cache_stats = (len(keys) - len(missing), len(missing))
+		return len(removed) + len(missing)
+
+	def iter_packages(self):
+		return self.records.items()
+
+class PollingWatcher(object):
+	"""
+	Looks for changes every 'interval' seconds, by comparing the mtimes of
+	the vdb categories (which change whenever a package is merged or
+	unmerged) and the configuration fingerprint. 'extra_paths' (e.g. the
+	payload config) are part of the configuration.
+	"""
+
+	def __init__(self, context, interval, extra_paths=()):
+		self.interval    = interval
+		self.extra_paths = list(extra_paths)
+		self.reset(context)
+
+	def reset(self, context):
+		"""
+		Starts over with the (reloaded) 'context'.
+		"""
+
+		self.context = context
+		self.reader  = VDBReader(context.vdb_path)
+		self.mtimes  = self.get_mtimes()
+		self.config  = self.get_fingerprint()
+
+	def get_mtimes(self):
+		mtimes = dict()
+		for category in self.reader.get_categories():
+			try:
+				mtimes[category] = os.stat(os.path.join(self.reader.vdb_path, \
+						category)).st_mtime
+			except OSError:
+				pass
+
+		return mtimes
+
+	def get_fingerprint(self):
+		mtimes = []
+		for path in self.extra_paths:
+			try:
+				mtimes.append(os.stat(path).st_mtime)
+			except OSError:
+				mtimes.append(None)
+
+		return config_fingerprint(self.context.settings, mtimes)
+
+	def wait(self, timeout=None):
+		"""
+		Waits until something changes, or for 'timeout' seconds (if not None).
+		Returns (changed categories, whether the configuration changed).
+		"""
+
+		deadline = None if timeout is None else time.time() + timeout
+		while True:
+			mtimes = self.get_mtimes()
+			changed = set(category for category in set(mtimes) | set(self.mtimes) \
+					if mtimes.get(category) != self.mtimes.get(category))
+			self.mtimes = mtimes
+
+			config = self.get_fingerprint()
+			config_changed = config != self.config
+			self.config = config
+
+			if changed or config_changed:
+				return changed, config_changed
+
+			delay = self.interval
+			if deadline is not None:
+				delay = min(delay, deadline - time.time())
+				if delay <= 0:
+					return set(), False
+
+			time.sleep(delay)
+
+class InotifyWatcher(object):
+	"""
+	Watches the vdb categories and the configuration (including
+	'extra_paths') with inotify. Only directories are watched (not every
+	package), to stay well below the inotify limits.
+	"""
+
+	def __init__(self, context, extra_paths=()):
+		self.vdb_path = os.path.normpath(context.vdb_path)
+		config_root = context.settings['PORTAGE_CONFIGROOT'] or '/'
+		self.config_paths = [os.path.join(config_root, p) for p in CONFIG_PATHS] \
+				+ [os.path.normpath(p) for p in extra_paths]
+
+		self.categories     = set()
+		self.config_changed = False
+
+		self.manager  = pyinotify.WatchManager()
+		self.notifier = pyinotify.Notifier(self.manager, self.handle)
+
+		self.manager.add_watch(self.vdb_path, DIRECTORY_MASK)
+		for category in VDBReader(self.vdb_path).get_categories():
+			self.watch_category(category)
+
+		# Files are often replaced rather than written to, so watch the
+		# directories they are in (and the directories themselves, e.g.
+		# package.use/, recursively):
+		for path in self.config_paths:
+			if os.path.isdir(path) and not os.path.islink(path):
+				self.manager.add_watch(path, CONFIG_MASK, rec=True, auto_add=True)
+			if os.path.isdir(os.path.dirname(path)):
+				self.manager.add_watch(os.path.dirname(path), CONFIG_MASK)
+
+	def watch_category(self, category):
+		path = os.path.join(self.vdb_path, category)
+		if os.path.isdir(path):
+			self.manager.add_watch(path, DIRECTORY_MASK)
+
+	def handle(self, event):
+		path = event.pathname
+
+		if os.path.dirname(path) == self.vdb_path:
+			category = os.path.basename(path)
+			if event.dir and event.mask & (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO):
+				self.watch_category(category)
+			self.categories.add(category)
+		elif os.path.dirname(os.path.dirname(path)) == self.vdb_path:
+			self.categories.add(os.path.basename(os.path.dirname(path)))
+		elif any(path == p or path.startswith(p + os.sep) for p in self.config_paths):
+			self.config_changed = True
+
+	def reset(self, context):
+		# The watched paths don't depend on the configuration.
+		pass
+
+	def wait(self, timeout=None):
+		"""
+		Like PollingWatcher.wait().
+		"""
+
+		if timeout is not None:
+			timeout = int(timeout * 1000)
+
+		if self.notifier.check_events(timeout):
+			self.notifier.read_events()
+			self.notifier.process_events()
+
+		result = (self.categories, self.config_changed)
+		self.categories     = set()
+		self.config_changed = False
+		return result
+
+class Agent(object):
+	"""
+	Module class.
+	"""
+
+	def set_args(self, parser):
+		"""Adds module arguments to parser."""
+
+		parser.add_argument( '-h', '--help'
+		                   , action='store_true'
+		                   , dest='help_dummy'
+		                   , only_in_help=True
+		                   , help="Display this help message (see also `submit -h`)"
+		)
+		parser.add_argument( '--debounce'
+		                   , type=float
+		                   , metavar="SECONDS"
+		                   , default=self.config.debounce
+		                   , help="Submit once nothing has changed for SECONDS\n"
+		                          "(default: %s)" % (self.config.debounce)
+		)
+		parser.add_argument( '--poll-interval'
+		                   , type=float
+		                   , metavar="SECONDS"
+		                   , default=self.config.poll_interval
+		                   , help="Look for changes every SECONDS when inotify is\n"
+		                          "not available (default: %s)" \
+		                           % (self.config.poll_interval)
+		)
+		parser.add_argument( '--no-inotify'
+		                   , action='store_true'
+		                   , default=self.config.no_inotify
+		                   , help="Poll even if pyinotify is available"
+		)
+
+	def __init__(self, config_updates=None):
+		self.config = Config()
+		self.config.update(MODULE_DEFAULT_CONFIG)
+
+		if config_updates:
+			self.config.update(config_updates)
+
+		self.arg_parser = ArgumentParserWrapper(
+			name     = MODULE_INFO[1],
+			desc     = MODULE_INFO[2],
+			indent   = self.config.indent,
+			indent_c = self.config.indent_c,
+		)
+		self.set_args(self.arg_parser)
+
+		self.submitter = Submit(config_updates)
+		self.context   = None
+		self.index     = None
+
+		self.payload_config = None
+
+	def run(self, args):
+		"""
+		Runs the module. Arguments that aren't the agent's are passed on to
+		the submit module.
+
+		@param args Input arguments to be parsed.
+		@type  args list
+		"""
+
+		args, submit_args = self.arg_parser.parse_known_args(args)
+		self.config.update(vars(args))
+
+		if self.config.debounce < 0:
+			self.arg_parser.error("Argument --debounce: must not be negative")
+
+		if self.config.poll_interval <= 0:
+			self.arg_parser.error("Argument --poll-interval: must be positive")
+
+		self.submitter.parse_args(submit_args)
+		submit_config = self.submitter.config
+
+		if submit_config.flush or submit_config.defer:
+			self.arg_parser.error("--flush and --defer don't make sense here")
+
+		roots = submit_config.root or []
+		if len(roots) > 1:
+			self.arg_parser.error("Only one --root can be watched")
+
+		self.root = roots[0] if roots else None
+		if self.root:
+			self.payload_file = self.submitter.get_root_payload_file(self.root)
+			self.auth_file    = get_root_path(self.root, submit_config.auth)
+			self.state_dir    = get_root_dir(submit_config.state_dir, self.root)
+		else:
+			self.payload_file = submit_config.payload
+			self.auth_file    = submit_config.auth
+			self.state_dir    = submit_config.state_dir
+
+		try:
+			self.refresh()
+			self.report()
+
+			watcher = self.get_watcher()
+			self.watch(watcher)
+		finally:
+			self.submitter.close()
+
+		return 0
+
+	def debug_print(self, verbosity_level, *args, **kwargs):
+		if self.config.verbose >= verbosity_level:
+			print(*args, **kwargs)
+			sys.stdout.flush()
+
+	def refresh(self):
+		"""
+		(Re)loads the portage configuration and the payload config, and
+		analyses all the packages. A broken payload config is fatal at
+		startup; on reloads, the previous one is kept.
+		"""
+
+		self.debug_print(1, "Loading the portage configuration and the packages...")
+
+		# portage.settings would never change, so always use our own:
+		self.context = CollectionContext.for_root(self.root or \
+				os.environ.get('ROOT') or '/')
+
+		try:
+			# get_payload_config() exits if the file can't be read:
+			payload_config = util.get_payload_config(self.payload_file)
+			fields = FieldSelection.from_config(payload_config).packages
+		except (ValueError, SystemExit) as e:
+			if isinstance(e, ValueError):
+				print('Error: Malformed payload config %s: %s' % (self.payload_file, e), \
+						file=sys.stderr)
+			if self.payload_config is None:
+				sys.exit(1)
+
+			print('Keeping the previous payload config', file=sys.stderr)
+			payload_config = self.payload_config
+			fields = self.index.fields
+
+		# Reports must have the fields that the index was built with:
+		self.payload_config = payload_config
+
+		cache = None
+		submit_config = self.submitter.config
+		if not submit_config.no_cache:
+			cache_dir = submit_config.cache_dir
+			if self.root:
+				cache_dir = get_root_dir(cache_dir, self.root)
+
+			cache = PackageCache(
+				os.path.join(cache_dir, PACKAGE_CACHE_FILE),
+				config_fingerprint(self.context.settings, list(fields))
+			)
+			cache.load()
+
+		self.index = PackageIndex(self.context, fields, submit_config.jobs, cache)
+		self.index.rescan()
+
+	def get_watcher(self):
+		if pyinotify is not None and not self.config.no_inotify:
+			try:
+				watcher = InotifyWatcher(self.context, [self.payload_file])
+				self.debug_print(2, "Watching the system with inotify")
+				return watcher
+			except (OSError, pyinotify.WatchManagerError) as e:
+				print("Warning: inotify is not usable (%s), polling instead" % e, \
+						file=sys.stderr)
+
+		self.debug_print(2, "Looking for changes every %ss" \
+				% self.config.poll_interval)
+		return PollingWatcher(self.context, self.config.poll_interval, \
+				[self.payload_file])
+
+	def watch(self, watcher):
+		"""
+		Submits a report after every (debounced) change. Never returns.
+		"""
+
+		categories = set()
+		reload     = False
+		last_event = None
+
+		while True:
+			timeout = None
+			if last_event is not None:
+				timeout = max(0, last_event + self.config.debounce - time.time())
+
+			changed, config_changed = watcher.wait(timeout)
+			if changed or config_changed:
+				categories |= changed
+				reload = reload or config_changed
+				last_event = time.time()
+				continue
+
+			if last_event is None:
+				continue
+
+			if self.index.reader.is_merging(categories):
+				last_event = time.time()
+				continue
+
+			if reload:
+				self.refresh()
+				watcher.reset(self.context)
+				self.report()
+			elif self.index.rescan(categories):
+				self.report()
+			else:
+				self.debug_print(2, "Nothing changed")
+
+			categories = set()
+			reload     = False
+			last_event = None
+
+	def report(self):
+		self.debug_print(1, "\nGenerating payload... ", end='')
+
+		payload = Payload(
+			payload_file=self.payload_file,
+			payload_config=self.payload_config,
+			auth_file=self.auth_file,
+			protocol=self.submitter.config.protocol,
+			context=self.context,
+			packages=self.index
+		)
+
+		return self.submitter.submit(payload, self.state_dir)
+
+def main(args, config=Config()):
+	return Agent(config).run(args)
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Aggregate statistics from a collection of stored reports, offline.
+
+Reports (JSON files, possibly compressed, e.g. those written by 'receive
+--store-dir') are read in parallel: every worker process aggregates a shard of
+the files into counters, which are then merged. Memory use depends on the
+number of distinct keys (packages, flags, repositories...), not on the number
+of reports.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import multiprocessing
+from collections import Counter
+
+from portage.versions import cpv_getkey
+
+from gentoostats.util import serialize, atomic_write
+from gentoostats.compression import decompress
+from gentoostats.protocol import DELTA_PROTOCOL
+from gentoostats.config import Config
+from gentoostats.encoding import decode_payload
+from gentoostats.argument_parser_wrapper import ArgumentParserWrapper
+
+MODULE_INFO = (
+	'a', 'analyze', 'aggregate statistics from stored reports'
+)
+
+MODULE_DEFAULT_CONFIG = dict(
+	verbose = 1,
+	jobs    = multiprocessing.cpu_count(),
+	top     = 20,
+	output  = None,
+)
+
+# Files with these suffixes are read from directories:
+COMPRESSED_SUFFIXES = ( ('.gz',  'gzip')
+                      , ('.bz2', 'bzip2')
+                      , ('.xz',  'xz')
+                      )
+REPORT_SUFFIXES = ('.json',) \
+		+ tuple('.json' + s for s, _ in COMPRESSED_SUFFIXES)
+
+# Reported ENV variables, counted per report:
+ENV_COUNTERS = ('ARCH', 'PROFILE', 'CFLAGS')
+# Counted per package:
+PACKAGE_COUNTERS = ('REPO', 'KEYWORD')
+
+# Counter -> title, in the order they are printed:
+TITLES = ( ('ARCH',    "Architectures")
+         , ('PROFILE', "Profiles")
+         , ('CFLAGS',  "CFLAGS")
+         , ('REPO',    "Repositories (installed packages)")
+         , ('KEYWORD', "Keywords (installed packages)")
+         , ('PACKAGE', "Packages (reports)")
+         , ('USE',     "USE flags (reports with the package)")
+         )
+
+# Only the first few errors are kept:
+MAX_ERRORS = 10
+
+class Aggregate(object):
+	"""
+	Counters over a number of reports. Aggregates of disjoint sets of reports
+	are combined with merge().
+
+	'PACKAGE' counts the reports in which each category/package is installed,
+	'USE' the reports in which a USE flag is enabled for a package (keyed by
+	'category/package flag').
+	"""
+
+	def __init__(self):
+		self.reports  = 0
+		self.skipped  = 0
+		self.failed   = 0
+		self.errors   = []
+		self.counters = dict((name, Counter()) for name, _ in TITLES)
+
+		# cpv -> category/package, as most cpvs are found in many reports:
+		self.cps = dict()
+
+	def get_cp(self, cpv):
+		try:
+			return self.cps[cpv]
+		except KeyError:
+			cp = self.cps[cpv] = cpv_getkey(cpv)
+			return cp
+
+	def add(self, payload):
+		"""
+		Counts the (decoded) report 'payload'.
+		"""
+
+		if not isinstance(payload, dict):
+			raise ValueError("not a report")
+
+		# A delta can't be counted without its base:
+		if payload.get('PROTOCOL') == DELTA_PROTOCOL:
+			self.skipped += 1
+			return
+
+		payload = decode_payload(payload)
+
+		env      = []
+		cps      = []
+		repos    = []
+		keywords = []
+		use      = []
+
+		for key in ENV_COUNTERS:
+			value = payload.get(key)
+			if value:
+				env.append((key, value))
+
+		get_cp = self.get_cp
+		for cpv, package_info in (payload.get('PACKAGES') or {}).items():
+			cp = get_cp(cpv)
+			if cp is None:
+				raise ValueError("invalid package %r" % (cpv,))
+			cps.append(cp)
+
+			if package_info.get('REPO'):
+				repos.append(package_info['REPO'])
+			if package_info.get('KEYWORD'):
+				keywords.append(package_info['KEYWORD'])
+
+			for flag in package_info.get('USE') or ():
+				use.append(cp + ' ' + flag)
+
+		# Nothing is counted until the whole report has been read:
+		for key, value in env:
+			self.counters[key][value] += 1
+
+		# Counter.update() counts iterables in C (on Python 3):
+		self.counters['PACKAGE'].update(set(cps))
+		self.counters['REPO'].update(repos)
+		self.counters['KEYWORD'].update(keywords)
+		self.counters['USE'].update(use)
+		self.reports += 1
+
+	def add_error(self, path, error):
+		self.failed += 1
+		if len(self.errors) < MAX_ERRORS:
+			self.errors.append("%s: %s" % (path, error))
+
+	def merge(self, other):
+		self.reports += other.reports
+		self.skipped += other.skipped
+		self.failed  += other.failed
+		self.errors   = (self.errors + other.errors)[:MAX_ERRORS]
+
+		for name, counter in other.counters.items():
+			self.counters[name].update(counter)
+
+	def to_dict(self):
+		"""
+		Returns the results as a JSON serializable dictionary.
+		"""
+
+		result = dict((name, dict(counter)) \
+				for name, counter in self.counters.items() if name != 'USE')
+
+		use = dict()
+		for key, count in self.counters['USE'].items():
+			cp, flag = key.split(' ', 1)
+			use.setdefault(cp, dict())[flag] = count
+		result['USE'] = use
+
+		result['REPORTS'] = self.reports
+		result['SKIPPED'] = self.skipped
+		result['FAILED']  = self.failed
+		return result
+
+def read_report(path):
+	"""
+	Reads the (possibly compressed) JSON report 'path'.
+	"""
+
+	with open(path, 'rb') as f:
+		data = f.read()
+
+	for suffix, content_encoding in COMPRESSED_SUFFIXES:
+		if path.endswith(suffix):
+			data = decompress(content_encoding, data)
+			break
+
+	return json.loads(data.decode('utf_8'))
+
+def iter_report_files(paths):
+	"""
+	Yields the report files in 'paths', which are files or directories
+	(searched recursively).
+	"""
+
+	for path in paths:
+		if not os.path.isdir(path):
+			yield path
+			continue
+
+		for directory, subdirs, files in os.walk(path):
+			subdirs.sort()
+			for name in sorted(files):
+				if name.endswith(REPORT_SUFFIXES):
+					yield os.path.join(directory, name)
+
+def analyse_files(paths):
+	"""
+	Returns the Aggregate of the report files 'paths'.
+	"""
+
+	aggregate = Aggregate()
+	for path in paths:
+		try:
+			aggregate.add(read_report(path))
+		except (IOError, OSError, KeyError, TypeError, AttributeError, \
+				IndexError, ValueError) as e:
+			aggregate.add_error(path, e)
+
+	return aggregate
+
+def iter_shards(items, shard_size):
+	for i in range(0, len(items), shard_size):
+		yield items[i:i + shard_size]
+
+class Analyze(object):
+	"""
+	Module class.
+	"""
+
+	def set_args(self, parser):
+		"""Adds module arguments to parser."""
+
+		parser.add_argument( '-h', '--help'
+		                   , action='store_true'
+		                   , dest='help_dummy'
+		                   , only_in_help=True
+		                   , help="Display this help message"
+		)
+		parser.add_argument( '-j', '--jobs'
+		                   , type=int
+		                   , metavar="N"
+		                   , default=self.config.jobs
+		                   , help="Read reports using N processes (default: %d)" \
+		                           % (self.config.jobs)
+		)
+		parser.add_argument( '-n', '--top'
+		                   , type=int
+		                   , metavar="N"
+		                   , default=self.config.top
+		                   , help="Print the N most common values of every\n"
+		                          "statistic (default: %d)" % (self.config.top)
+		)
+		parser.add_argument( '-o', '--output'
+		                   , metavar="FILE"
+		                   , default=self.config.output
+		                   , help="Write all the results to FILE, as JSON"
+		)
+		parser.add_argument( 'paths'
+		                   , nargs='+'
+		                   , metavar="PATH"
+		                   , help="Report files, or directories of\n"
+		                          "*.json[.gz|.bz2|.xz] reports"
+		)
+
+	def __init__(self, config_updates=None):
+		self.config = Config()
+		self.config.update(MODULE_DEFAULT_CONFIG)
+
+		if config_updates:
+			self.config.update(config_updates)
+
+		self.arg_parser = ArgumentParserWrapper(
+			name     = MODULE_INFO[1],
+			desc     = MODULE_INFO[2],
+			indent   = self.config.indent,
+			indent_c = self.config.indent_c,
+		)
+		self.set_args(self.arg_parser)
+
+	def run(self, args):
+		"""
+		Runs the module.
+
+		@param args Input arguments to be parsed.
+		@type  args list
+		"""
+
+		self.config.update(vars(self.arg_parser.parse_args(args)))
+
+		if self.config.jobs < 1:
+			self.arg_parser.error("Argument -j/--jobs: must be at least 1")
+
+		files = list(iter_report_files(self.config.paths))
+		aggregate = self.analyse(files)
+
+		if self.config.verbose:
+			self.print_results(aggregate)
+
+		for error in aggregate.errors:
+			print("Error: %s" % error, file=sys.stderr)
+
+		if self.config.output:
+			if not atomic_write(self.config.output, \
+					serialize(aggregate.to_dict(), human=True)):
+				print("Error: unable to write '%s'" % self.config.output, \
+						file=sys.stderr)
+				return 1
+
+		return 0 if aggregate.reports else 1
+
+	def analyse(self, files):
+		"""
+		Returns the Aggregate of 'files'.
+		"""
+
+		jobs = min(self.config.jobs, len(files))
+		if jobs <= 1:
+			return analyse_files(files)
+
+		# Several shards per process, to balance the load:
+		shard_size = max(1, -(-len(files) // (jobs * 4)))
+
+		aggregate = Aggregate()
+		pool = multiprocessing.Pool(jobs)
+		try:
+			for result in pool.imap_unordered(analyse_files, \
+					iter_shards(files, shard_size)):
+				aggregate.merge(result)
+			pool.close()
+		except BaseException:
+			# Don't wait for the outstanding shards on errors or ^C:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+
+		return aggregate
+
+	def print_results(self, aggregate):
+		print("Reports: %d (%d deltas skipped, %d unreadable)" \
+				% (aggregate.reports, aggregate.skipped, aggregate.failed))
+
+		installed = aggregate.counters['PACKAGE']
+		for name, title in TITLES:
+			counter = aggregate.counters[name]
+			if not counter:
+				continue
+
+			total = sum(counter.values())
+
+			print("\n%s:" % title)
+			for key, count in counter.most_common(self.config.top):
+				if name == 'USE':
+					cp, flag = key.split(' ', 1)
+					key = '%s[%s]' % (cp, flag)
+					share = 100.0 * count / installed[cp]
+				elif name in PACKAGE_COUNTERS:
+					share = 100.0 * count / total
+				else:
+					share = 100.0 * count / aggregate.reports
+
+				print("  %-50s %8d %6.1f%%" % (key, count, share))
+
+def main(args, config=Config()):
+	return Analyze(config).run(args)
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -18,9 +18,9 @@ try:
 except ImportError:
 	import configparser as ConfigParser
 
-import gentoolkit
 from portage import output
 
+from gentoostats.app_util import load_gentoolkit
 from gentoostats.config import Config
 from gentoostats.argument_parser_wrapper import ArgumentParserWrapper
 
@@ -28,6 +28,9 @@ MODULE_INFO = (
 	'c', 'configure', 'configure gentoostats'
 )
 
+# Messages are printed with gentoolkit's pretty printer:
+gentoolkit = load_gentoolkit()
+
 MODULE_DEFAULT_CONFIG = dict(
 	verbose      = 0,
 	settings_dir = "/etc/gentoostats/",
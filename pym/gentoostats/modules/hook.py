@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Record a package that portage has just merged or unmerged.
+
+Meant to be run from the pkg_postinst and pkg_postrm phases of every package
+(see bashrc.example). After a merge the record of the package is computed
+right away, and it is added to the journal next to the package cache; after
+an unmerge its removal is. `submit --incremental` then applies the journal to
+the cache instead of looking at every installed package.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+from gentoostats import util
+from gentoostats.cache import PackageJournal, DEFAULT_CACHE_DIR, JOURNAL_DIR, \
+		config_fingerprint, entry_key
+from gentoostats.config import Config
+from gentoostats.fields import FieldSelection
+from gentoostats.payload import iter_analyse_cpvs
+from gentoostats.context import CollectionContext
+from gentoostats.vdb import VDBReader
+from gentoostats.modules.submit import get_root_payload_file, get_root_dir
+from gentoostats.argument_parser_wrapper import ArgumentParserWrapper
+
+MODULE_INFO = (
+	'k', 'hook', 'record a merged or unmerged package (run by portage)'
+)
+
+MODULE_DEFAULT_CONFIG = dict(
+	verbose   = 1,
+	payload   = '/etc/gentoostats/payload.cfg',
+	cache_dir = DEFAULT_CACHE_DIR,
+	root      = None,
+)
+
+PHASES = ('postinst', 'postrm')
+
+class Hook(object):
+	"""
+	Module class.
+	"""
+
+	def set_args(self, parser):
+		"""Adds module arguments to parser."""
+
+		parser.add_argument( '-h', '--help'
+		                   , action='store_true'
+		                   , dest='help_dummy'
+		                   , only_in_help=True
+		                   , help="Display this help message"
+		)
+		parser.add_argument( '-P', '--payload'
+		                   , metavar="FILE"
+		                   , default=self.config.payload
+		                   , help="Payload config file\n(default: %s)" \
+		                           % (self.config.payload)
+		)
+		parser.add_argument( '--cache-dir'
+		                   , metavar="DIR"
+		                   , default=self.config.cache_dir
+		                   , help="Package cache directory\n(default: %s)" \
+		                           % (self.config.cache_dir)
+		)
+		parser.add_argument( '--root'
+		                   , metavar="DIR"
+		                   , default=self.config.root
+		                   , help="The package was merged into DIR (see `submit -h`)"
+		)
+		parser.add_argument( 'phase'
+		                   , choices=PHASES
+		                   , metavar="PHASE"
+		                   , help="The phase the hook is run from: %s" \
+		                           % (' or '.join(PHASES))
+		)
+		parser.add_argument( 'cpv'
+		                   , metavar="CPV"
+		                   , help="The package, as category/name-version"
+		)
+
+	def __init__(self, config_updates=None):
+		self.config = Config()
+		self.config.update(MODULE_DEFAULT_CONFIG)
+
+		if config_updates:
+			self.config.update(config_updates)
+
+		self.arg_parser = ArgumentParserWrapper(
+			name     = MODULE_INFO[1],
+			desc     = MODULE_INFO[2],
+			indent   = self.config.indent,
+			indent_c = self.config.indent_c,
+		)
+		self.set_args(self.arg_parser)
+
+	def run(self, args):
+		"""
+		Runs the module.
+
+		@param args Input arguments to be parsed.
+		@type  args list
+		"""
+
+		self.config.update(vars(self.arg_parser.parse_args(args)))
+
+		root      = self.config.root
+		cpv       = self.config.cpv
+		cache_dir = self.config.cache_dir
+		if root:
+			cache_dir = get_root_dir(cache_dir, root)
+
+		journal = PackageJournal(os.path.join(cache_dir, JOURNAL_DIR))
+
+		if self.config.phase == 'postrm':
+			# No need to load the portage configuration for this:
+			written = journal.add(cpv, None, None, None)
+		else:
+			written = self.record_merge(journal, cpv, root)
+			if written is None:
+				return 1
+
+		if not written:
+			print("Error: unable to write to '%s'" % journal.path, file=sys.stderr)
+			return 1
+
+		if self.config.verbose >= 2:
+			change = 'unmerge' if self.config.phase == 'postrm' else 'merge'
+			print("Recorded the %s of %s" % (change, cpv))
+
+		return 0
+
+	def record_merge(self, journal, cpv, root):
+		"""
+		Adds the record of the merged package 'cpv' to 'journal'. Returns
+		whether it was written, or None on error.
+		"""
+
+		payload_file = self.config.payload
+		if root:
+			payload_file = get_root_payload_file(root, payload_file)
+
+		try:
+			fields = FieldSelection.from_config( \
+					util.get_payload_config(payload_file)).packages
+		except ValueError as e:
+			print('Error: Malformed payload config %s: %s' % (payload_file, e), \
+					file=sys.stderr)
+			return None
+
+		if not fields:
+			# Packages aren't reported at all:
+			return True
+
+		context = CollectionContext.for_root(root) if root else CollectionContext()
+		reader  = VDBReader(context.vdb_path)
+		path    = reader.get_path(cpv)
+
+		if not os.path.isdir(path):
+			print("Error: '%s' is not installed" % cpv, file=sys.stderr)
+			return None
+
+		_, record = next(iter_analyse_cpvs([cpv], fields, context, reader))
+		fingerprint = config_fingerprint(context.settings, list(fields))
+
+		return journal.add(cpv, entry_key(path), record, fingerprint)
+
+def main(args, config=Config()):
+	return Hook(config).run(args)
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
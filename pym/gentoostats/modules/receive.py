@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Receive reports locally, as a stand-in for the gentoostats server.
+
+Speaks the upload protocol (chunked or not, compressed or not, plain, delta
+and compact reports, and the HEAD probe that precedes deltas), so that the
+submit path can be tested and benchmarked without a live service. Accepted
+reports can be stored, and throughput and latency statistics are printed on
+exit.
+"""
+
+from __future__ import print_function
+
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn
+
+try:
+	from urllib import quote
+except ImportError:
+	from urllib.parse import quote
+
+import os
+import sys
+import json
+import math
+import time
+import base64
+import threading
+
+from gentoostats.util import serialize, content_hash, atomic_write
+from gentoostats.compression import decompress
+from gentoostats.delta import get_snapshot, apply_delta
+from gentoostats.config import Config
+from gentoostats.protocol import PROTOCOL, DELTA_PROTOCOL, COMPACT_PROTOCOL
+from gentoostats.encoding import decode_payload
+from gentoostats.argument_parser_wrapper import ArgumentParserWrapper
+
+MODULE_INFO = (
+	'r', 'receive', 'receive reports locally (a test server)'
+)
+
+MODULE_DEFAULT_CONFIG = dict(
+	verbose   = 1,
+	listen    = '127.0.0.1:8080',
+	url       = '/upload/',
+	store_dir = None,
+	interval  = 0,
+	requests  = 0,
+)
+
+class RequestError(Exception):
+	"""
+	A report that is rejected with the HTTP status 'status'.
+	"""
+
+	def __init__(self, status, message):
+		Exception.__init__(self, message)
+		self.status = status
+
+def percentile(values, p):
+	"""
+	Returns the 'p'th percentile of the sorted list 'values' (nearest rank).
+
+	>>> percentile([1, 2, 3, 4], 50)
+	2
+	>>> percentile([1, 2, 3, 4], 100)
+	4
+	"""
+
+	if not values:
+		return 0
+	rank = max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)
+	return values[min(rank, len(values) - 1)]
+
+class Statistics(object):
+	"""
+	Request counts, sizes and latencies. Thread-safe.
+	"""
+
+	def __init__(self):
+		self.lock      = threading.Lock()
+		self.started   = time.time()
+		self.requests  = 0
+		self.bytes     = 0
+		self.statuses  = dict()
+		self.latencies = []
+
+		# Since the last call of take_interval():
+		self.interval_start    = self.started
+		self.interval_requests = 0
+		self.interval_bytes    = 0
+
+	def add(self, status, size, latency):
+		with self.lock:
+			self.requests += 1
+			self.bytes    += size
+			self.statuses[status] = self.statuses.get(status, 0) + 1
+			self.latencies.append(latency)
+
+			self.interval_requests += 1
+			self.interval_bytes    += size
+
+			return self.requests
+
+	def take_interval(self):
+		"""
+		Returns (seconds, requests, bytes) since the last call.
+		"""
+
+		with self.lock:
+			now = time.time()
+			result = ( now - self.interval_start
+			         , self.interval_requests
+			         , self.interval_bytes
+			         )
+
+			self.interval_start    = now
+			self.interval_requests = self.interval_bytes = 0
+
+			return result
+
+	def print_summary(self, stream=sys.stdout):
+		with self.lock:
+			elapsed   = max(time.time() - self.started, 1e-9)
+			latencies = sorted(self.latencies)
+
+			print("Requests:   %d in %.1fs (%.1f/s)" \
+					% (self.requests, elapsed, self.requests / elapsed), file=stream)
+			print("Received:   %d bytes (%.1f KiB/s)" \
+					% (self.bytes, self.bytes / elapsed / 1024), file=stream)
+			print("Statuses:   %s" % ', '.join('%d: %d' % item \
+					for item in sorted(self.statuses.items())), file=stream)
+
+			if latencies:
+				print("Latency:    avg %.1fms, p50 %.1fms, p95 %.1fms, "
+				      "p99 %.1fms, max %.1fms" \
+						% tuple(1000 * x for x in ( sum(latencies) / len(latencies)
+						                          , percentile(latencies, 50)
+						                          , percentile(latencies, 95)
+						                          , percentile(latencies, 99)
+						                          , latencies[-1]
+						)), file=stream)
+
+class ReportStore(object):
+	"""
+	The last accepted report of every UUID (needed to apply deltas), also
+	written to 'store_dir' if it is given. Thread-safe.
+	"""
+
+	def __init__(self, store_dir=None):
+		self.store_dir = store_dir
+		self.lock      = threading.Lock()
+		self.reports   = dict()
+
+	def get(self, uuid):
+		"""
+		Returns (passwd, snapshot, hash) of the last report of 'uuid', or None.
+		"""
+
+		with self.lock:
+			return self.reports.get(uuid)
+
+	def put(self, uuid, passwd, snapshot, snapshot_hash):
+		with self.lock:
+			self.reports[uuid] = (passwd, snapshot, snapshot_hash)
+
+		if self.store_dir is not None:
+			path = os.path.join(self.store_dir, quote(uuid, safe='') + '.json')
+			if not atomic_write(path, serialize(snapshot), mode=0o600):
+				print("Warning: unable to write '%s'" % path, file=sys.stderr)
+
+	def accept(self, payload):
+		"""
+		Validates the decoded request body 'payload' and stores the report.
+		Returns its UUID, or raises RequestError.
+		"""
+
+		if not isinstance(payload, dict):
+			raise RequestError(400, "Not a report")
+
+		protocol = payload.get('PROTOCOL')
+		if protocol not in (PROTOCOL, DELTA_PROTOCOL, COMPACT_PROTOCOL):
+			raise RequestError(400, "Unsupported protocol %r" % (protocol,))
+
+		try:
+			uuid   = payload['AUTH']['UUID']
+			passwd = payload['AUTH']['PASSWD']
+		except (KeyError, TypeError):
+			raise RequestError(400, "Missing AUTH")
+
+		last = self.get(uuid)
+		if last is not None and last[0] != passwd:
+			raise RequestError(403, "Wrong password")
+
+		try:
+			if protocol == DELTA_PROTOCOL:
+				if last is None or last[2] != payload.get('BASE'):
+					raise RequestError(412, "Unknown base report")
+
+				snapshot = apply_delta(last[1], payload['DELTA'])
+				snapshot_hash = content_hash(snapshot)
+				if snapshot_hash != payload.get('HASH'):
+					raise RequestError(400, "The delta doesn't match its hash")
+			else:
+				snapshot = get_snapshot(decode_payload(payload))
+				snapshot_hash = content_hash(snapshot)
+		except (KeyError, TypeError, AttributeError, IndexError, ValueError) as e:
+			raise RequestError(400, "Malformed report: %s" % e)
+
+		self.put(uuid, passwd, snapshot, snapshot_hash)
+		return uuid
+
+class ReceiveHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def read_body(self):
+		"""
+		Returns the request body (bytes), chunked or not.
+		"""
+
+		if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+			chunks = []
+			while True:
+				line = self.rfile.readline()
+				try:
+					length = int(line.split(b';')[0].strip(), 16)
+				except ValueError:
+					raise RequestError(400, "Malformed chunk")
+
+				if length == 0:
+					# Skip any trailers:
+					while self.rfile.readline().strip():
+						pass
+					return b''.join(chunks)
+
+				chunks.append(self.rfile.read(length))
+				self.rfile.readline()
+
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+		except ValueError:
+			raise RequestError(400, "Malformed Content-Length")
+		return self.rfile.read(length)
+
+	def do_POST(self):
+		started = time.time()
+		size = 0
+		uuid = None
+
+		try:
+			if self.path.rstrip('/') + '/' != self.server.url:
+				self.close_connection = True
+				raise RequestError(404, "Not found")
+
+			try:
+				body = self.read_body()
+			except RequestError:
+				self.close_connection = True
+				raise
+			size = len(body)
+
+			try:
+				body = decompress(self.headers.get('Content-Encoding'), body)
+			except ValueError as e:
+				raise RequestError(415, str(e))
+
+			try:
+				payload = json.loads(body.decode('utf_8'))
+			except ValueError as e:
+				raise RequestError(400, "Malformed JSON: %s" % e)
+
+			uuid = self.server.store.accept(payload)
+			status, message = 200, "OK"
+		except RequestError as e:
+			status, message = e.status, str(e)
+
+		response = message.encode('utf_8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'text/plain; charset=utf-8')
+		self.send_header('Content-Length', str(len(response)))
+		self.end_headers()
+		self.wfile.write(response)
+
+		self.log_request_done(started, status, message, size, uuid)
+
+	def do_HEAD(self):
+		"""
+		Answers whether the report whose hash is in If-None-Match is the last
+		one of the UUID given with HTTP basic authentication: 304 if it is,
+		otherwise 200. Either way, the ETag is the hash of the last report.
+		"""
+
+		started = time.time()
+		uuid = None
+		etag = None
+
+		try:
+			if self.path.rstrip('/') + '/' != self.server.url:
+				raise RequestError(404, "Not found")
+
+			scheme, _, credentials = self.headers.get('Authorization', '').partition(' ')
+			try:
+				credentials = base64.b64decode(credentials.encode('ascii')).decode('utf_8')
+			except (TypeError, ValueError):
+				credentials = ''
+
+			uuid, _, passwd = credentials.partition(':')
+			if scheme.lower() != 'basic' or not uuid:
+				uuid = None
+				raise RequestError(401, "Missing credentials")
+
+			last = self.server.store.get(uuid)
+			if last is None:
+				raise RequestError(404, "Unknown UUID")
+			if last[0] != passwd:
+				raise RequestError(403, "Wrong password")
+
+			etag = '"%s"' % last[2]
+			tags = [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]
+			if etag in tags:
+				status, message = 304, "Not Modified"
+			else:
+				status, message = 200, "OK"
+		except RequestError as e:
+			status, message = e.status, str(e)
+
+		self.send_response(status)
+		if etag is not None:
+			self.send_header('ETag', etag)
+		if status == 401:
+			self.send_header('WWW-Authenticate', 'Basic realm="gentoostats"')
+		self.send_header('Content-Length', '0')
+		self.end_headers()
+
+		self.log_request_done(started, status, message, 0, uuid)
+
+	def log_request_done(self, started, status, message, size, uuid):
+		"""
+		Counts the request and prints it (and stops the server after the
+		requested number of requests).
+		"""
+
+		latency = time.time() - started
+		count = self.server.stats.add(status, size, latency)
+
+		if self.server.verbose >= 2:
+			print("%s %s: %d (%s), %d bytes, %.1fms" % ( self.client_address[0]
+			                                          , uuid or '-'
+			                                          , status, message, size
+			                                          , 1000 * latency
+			))
+
+		if self.server.max_requests and count == self.server.max_requests:
+			threading.Thread(target=self.server.shutdown).start()
+
+	def log_message(self, *args):
+		pass
+
+class ReceiveServer(ThreadingMixIn, HTTPServer):
+	"""
+	Handles every connection in its own thread.
+	"""
+
+	daemon_threads = True
+	request_queue_size = 128
+
+	def __init__(self, address, url, store, verbose=1, max_requests=0):
+		HTTPServer.__init__(self, address, ReceiveHandler)
+		self.url          = url
+		self.store        = store
+		self.stats        = Statistics()
+		self.verbose      = verbose
+		self.max_requests = max_requests
+
+class Receive(object):
+	"""
+	Module class.
+	"""
+
+	def set_args(self, parser):
+		"""Adds module arguments to parser."""
+
+		parser.add_argument( '-h', '--help'
+		                   , action='store_true'
+		                   , dest='help_dummy'
+		                   , only_in_help=True
+		                   , help="Display this help message"
+		)
+		parser.add_argument( '-l', '--listen'
+		                   , metavar="ADDR"
+		                   , default=self.config.listen
+		                   , help="Address to listen on, as host:port\n"
+		                          "(default: %s)" % (self.config.listen)
+		)
+		parser.add_argument( '-u', '--url'
+		                   , default=self.config.url
+		                   , help="Upload URL (default: %s)" % (self.config.url)
+		)
+		parser.add_argument( '--store-dir'
+		                   , metavar="DIR"
+		                   , default=self.config.store_dir
+		                   , help="Write the last report of every UUID to DIR"
+		)
+		parser.add_argument( '--interval'
+		                   , type=float
+		                   , metavar="SECONDS"
+		                   , default=self.config.interval
+		                   , help="Print the throughput every SECONDS"
+		)
+		parser.add_argument( '-n', '--requests'
+		                   , type=int
+		                   , metavar="N"
+		                   , default=self.config.requests
+		                   , help="Exit after N requests"
+		)
+
+	def __init__(self, config_updates=None):
+		self.config = Config()
+		self.config.update(MODULE_DEFAULT_CONFIG)
+
+		if config_updates:
+			self.config.update(config_updates)
+
+		self.arg_parser = ArgumentParserWrapper(
+			name     = MODULE_INFO[1],
+			desc     = MODULE_INFO[2],
+			indent   = self.config.indent,
+			indent_c = self.config.indent_c,
+		)
+		self.set_args(self.arg_parser)
+
+	def run(self, args):
+		"""
+		Runs the module.
+
+		@param args Input arguments to be parsed.
+		@type  args list
+		"""
+
+		self.config.update(vars(self.arg_parser.parse_args(args)))
+
+		host, _, port = self.config.listen.rpartition(':')
+		try:
+			address = (host or '127.0.0.1', int(port))
+		except ValueError:
+			self.arg_parser.error("Argument -l/--listen: expected host:port")
+
+		if self.config.interval < 0:
+			self.arg_parser.error("Argument --interval: must not be negative")
+
+		try:
+			server = ReceiveServer( address
+			                      , url          = self.config.url.rstrip('/') + '/'
+			                      , store        = ReportStore(self.config.store_dir)
+			                      , verbose      = self.config.verbose
+			                      , max_requests = self.config.requests
+			)
+		except (IOError, OSError) as e:
+			print("Error: unable to listen on %s: %s" % (self.config.listen, e), \
+					file=sys.stderr)
+			return 1
+
+		if self.config.verbose:
+			print("Listening on http://%s:%d%s" % (server.server_address[:2] \
+					+ (server.url,)))
+			sys.stdout.flush()
+
+		stop = threading.Event()
+		if self.config.interval:
+			reporter = threading.Thread(target=self.report, args=(server, stop))
+			reporter.daemon = True
+			reporter.start()
+
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			stop.set()
+			server.server_close()
+
+		if self.config.verbose:
+			print("")
+			server.stats.print_summary()
+
+		return 0
+
+	def report(self, server, stop):
+		"""
+		Prints the throughput every --interval seconds, until 'stop' is set.
+		"""
+
+		while not stop.wait(self.config.interval):
+			seconds, requests, size = server.stats.take_interval()
+			print("%.1f requests/s, %.1f KiB/s" \
+					% (requests / seconds, size / seconds / 1024))
+			sys.stdout.flush()
+
+def main(args, config=Config()):
+	return Receive(config).run(args)
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
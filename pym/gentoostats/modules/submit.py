@@ -16,11 +16,37 @@ try:
 except ImportError:
 	import http.client as httplib
 
+try:
+	from urllib import quote
+except ImportError:
+	from urllib.parse import quote
+
+import os
 import sys
+import json
+import time
+import base64
+import socket
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
+import portage
+
+from gentoostats import timing
 from gentoostats.util import serialize, FlexibleBool
+from gentoostats.cache import DEFAULT_CACHE_DIR
+from gentoostats.compression import available_codecs, default_codec, \
+		get_compressor, get_content_encoding
+from gentoostats.delta import SnapshotStore, make_delta_payload
 from gentoostats.config import Config
 from gentoostats.payload import Payload
+from gentoostats.protocol import PROTOCOL, DELTA_PROTOCOL, COMPACT_PROTOCOL
+from gentoostats.context import CollectionContext
+from gentoostats.encoding import decode_payload
+from gentoostats.pipeline import prefetch
+from gentoostats.uploader import Uploader, DEFAULT_TIMEOUT, \
+		DEFAULT_MAX_CONNECTIONS
+from gentoostats.spool import Spool, DEFAULT_SPOOL_DIR, get_backoff
 from gentoostats.argument_parser_wrapper import ArgumentParserWrapper
 
 # You can also use __name__.split('.')[-1] here.
@@ -37,8 +63,33 @@ MODULE_DEFAULT_CONFIG = dict(
 	verbose      = 1,
 	pretend      = False,
 	ssl          = True,
+	jobs         = 1,
+	cache_dir    = DEFAULT_CACHE_DIR,
+	no_cache     = False,
+	incremental  = False,
+	state_dir    = '/var/lib/gentoostats',
+	full         = False,
+	compress     = default_codec(),
+	protocol     = PROTOCOL,
+	root         = None,
+	spool_dir    = DEFAULT_SPOOL_DIR,
+	no_spool     = False,
+	defer        = False,
+	flush        = False,
+	timeout      = DEFAULT_TIMEOUT,
+	connections  = DEFAULT_MAX_CONNECTIONS,
+	pipeline     = False,
+	no_probe     = False,
 )
 
+SNAPSHOT_FILE = 'last_payload.json'
+
+# Streamed reports are compressed and sent in blocks of about this size:
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+# The server answers a delta with this status if it doesn't have its base:
+BASE_REJECTED_STATUS = httplib.PRECONDITION_FAILED
+
 class Submit(object):
 	"""
 	Module class.
@@ -85,6 +136,124 @@ class Submit(object):
 		                   , help="Use SSL when uploading stats (default: %s)" \
 		                           % ('yes' if self.config.ssl else 'no')
 		)
+		parser.add_argument( '--timeout'
+		                   , type=float
+		                   , metavar="SECONDS"
+		                   , default=self.config.timeout
+		                   , help="Network timeout (default: %s)" \
+		                           % (self.config.timeout)
+		)
+		parser.add_argument( '--connections'
+		                   , type=int
+		                   , metavar="N"
+		                   , default=self.config.connections
+		                   , help="Maximum number of simultaneous connections to\n"
+		                          "the server (default: %d)" \
+		                           % (self.config.connections)
+		)
+		parser.add_argument( '--pipeline'
+		                   , action='store_true'
+		                   , default=self.config.pipeline
+		                   , help="Upload the full report while it is being\n"
+		                          "generated in a separate thread"
+		)
+		parser.add_argument( '--no-probe'
+		                   , action='store_true'
+		                   , default=self.config.no_probe
+		                   , help="Don't ask the server whether it already has the\n"
+		                          "report before uploading the changes since the\n"
+		                          "last one"
+		)
+		parser.add_argument( '-j', '--jobs'
+		                   , type=int
+		                   , metavar="N"
+		                   , default=self.config.jobs
+		                   , help="Analyse packages using N processes (default: %d)" \
+		                           % (self.config.jobs)
+		)
+		parser.add_argument( '--cache-dir'
+		                   , metavar="DIR"
+		                   , default=self.config.cache_dir
+		                   , help="Package cache directory\n(default: %s)" \
+		                           % (self.config.cache_dir)
+		)
+		parser.add_argument( '--no-cache'
+		                   , action='store_true'
+		                   , default=self.config.no_cache
+		                   , help="Recompute all package records and don't update\n"
+		                          "the cache"
+		)
+		parser.add_argument( '--incremental'
+		                   , action='store_true'
+		                   , default=self.config.incremental
+		                   , help="Only analyse the packages merged since the last\n"
+		                          "run, as recorded by the portage hook (see\n"
+		                          "`hook -h`)"
+		)
+		parser.add_argument( '--state-dir'
+		                   , metavar="DIR"
+		                   , default=self.config.state_dir
+		                   , help="Where to keep the last acknowledged report\n"
+		                          "(default: %s)" % (self.config.state_dir)
+		)
+		parser.add_argument( '-f', '--full'
+		                   , action='store_true'
+		                   , default=self.config.full
+		                   , help="Upload the full report instead of the changes\n"
+		                          "since the last acknowledged one"
+		)
+		parser.add_argument( '--compress'
+		                   , choices=available_codecs()
+		                   , metavar="CODEC"
+		                   , default=self.config.compress
+		                   , help="Compress the report with CODEC (%s)\n"
+		                          "(default: %s)" \
+		                           % ( ', '.join(available_codecs())
+		                             , self.config.compress
+		                             )
+		)
+		parser.add_argument( '--root'
+		                   , action='append'
+		                   , metavar="DIR"
+		                   , default=self.config.root
+		                   , help="Report the system installed in DIR (e.g. a\n"
+		                          "chroot) instead of the running one. Can be given\n"
+		                          "several times; its auth config is read from\n"
+		                          "inside DIR"
+		)
+		parser.add_argument( '--spool-dir'
+		                   , metavar="DIR"
+		                   , default=self.config.spool_dir
+		                   , help="Where to keep reports that couldn't be sent\n"
+		                          "(default: %s)" % (self.config.spool_dir)
+		)
+		parser.add_argument( '--no-spool'
+		                   , action='store_true'
+		                   , default=self.config.no_spool
+		                   , help="Don't spool reports that couldn't be sent"
+		)
+		parser.add_argument( '--defer'
+		                   , action='store_true'
+		                   , default=self.config.defer
+		                   , help="Spool the report instead of sending it"
+		)
+		parser.add_argument( '--flush'
+		                   , action='store_true'
+		                   , default=self.config.flush
+		                   , help="Send the spooled reports that are due and exit"
+		)
+		parser.add_argument( '--protocol'
+		                   , type=int
+		                   , choices=[PROTOCOL, COMPACT_PROTOCOL]
+		                   , metavar="VERSION"
+		                   , default=self.config.protocol
+		                   , help="Protocol version for full reports: %d (plain)\n"
+		                          "or %d (compact string table encoding)\n"
+		                          "(default: %d)" \
+		                           % ( PROTOCOL, COMPACT_PROTOCOL
+		                             , self.config.protocol
+		                             )
+		)
 
 	def __init__(self, config_updates=None):
 		self.config = Config()
@@ -101,6 +270,9 @@ class Submit(object):
 		)
 		self.set_args(self.arg_parser)
 
+		# Created on the first upload (see get_uploader()):
+		self.uploader = None
+
 	def run(self, args):
 		"""runs the module
 
@@ -108,39 +280,169 @@ class Submit(object):
 		@type  args list
 		"""
 
+		self.parse_args(args)
+		full_upload_url = self.config.server + self.config.url
+
+		if self.config.verbose:
+			print("Using URL: '%s'" % (full_upload_url))
+			print("Using SSL: %s"   % (self.config.ssl))
+			if self.config.pretend:
+				print("Dry run:   %s" % (self.config.pretend))
+
+		try:
+			return self.run_submissions()
+		finally:
+			self.close()
+
+	def parse_args(self, args):
+		"""
+		Parses and checks the module arguments (see also the agent module).
+		"""
+
 		self.config.update(vars(self.arg_parser.parse_args(args)))
 
+		if self.config.jobs < 1:
+			self.arg_parser.error("Argument -j/--jobs: must be at least 1")
+
+		if self.config.connections < 1:
+			self.arg_parser.error("Argument --connections: must be at least 1")
+
+		if self.config.timeout <= 0:
+			self.arg_parser.error("Argument --timeout: must be positive")
+
 		if self.config.ssl == False and \
 				self.config.server == MODULE_DEFAULT_CONFIG['server']:
 			print("Note: Have you forgotten to change the port number?")
 			print("You may want to try '%s'." % self.config.server_nossl)
 
 		self.config.url = self.config.url.rstrip('/') + '/'
-		full_upload_url = self.config.server + self.config.url
 
-		if self.config.verbose:
-			print("Using URL: '%s'" % (full_upload_url))
-			print("Using SSL: %s"   % (self.config.ssl))
-			if self.config.pretend:
-				print("Dry run:   %s" % (self.config.pretend))
+	def close(self):
+		"""
+		Closes the connections to the server.
+		"""
+
+		if self.uploader is not None:
+			if self.config.verbose >= 2:
+				print("Sent %d requests over %d connections" \
+						% (self.uploader.requests, self.uploader.connections))
+			self.uploader.close()
 
+	def run_submissions(self):
+		"""
+		Runs the submissions requested on the command line and returns the
+		exit status.
+		"""
+
+		if self.config.flush:
+			return self.flush()
+
+		if self.config.root:
+			return self.run_roots(self.config.root)
+
+		if self.config.verbose:
 			print("\nGenerating payload... ", end='')
 			sys.stdout.flush()
 
 		payload = Payload(
 			payload_file=self.config.payload,
-			auth_file=self.config.auth
+			auth_file=self.config.auth,
+			jobs=self.config.jobs,
+			cache_dir=None if self.config.no_cache else self.config.cache_dir,
+			protocol=self.config.protocol,
+			incremental=self.config.incremental
 		)
-		post_data = payload.get()
+
+		return self.submit(payload, self.config.state_dir)
+
+	def run_roots(self, roots):
+		"""
+		Collects the reports of several roots in parallel and submits each of
+		them. Every root is reported under its own UUID, read from the auth
+		config below that root.
+		"""
+
+		# Worker processes can't start worker processes of their own, so with
+		# several roots -j/--jobs applies across roots:
+		jobs = min(self.config.jobs, len(roots))
+		package_jobs = self.config.jobs if jobs == 1 else 1
+
+		if self.config.verbose:
+			print("\nCollecting %d roots using %d processes... " \
+					% (len(roots), jobs), end='')
+			sys.stdout.flush()
+
+		tasks = [( root
+		         , self.get_root_payload_file(root)
+		         , get_root_path(root, self.config.auth)
+		         , None if self.config.no_cache \
+		                else get_root_dir(self.config.cache_dir, root)
+		         , self.config.protocol
+		         , package_jobs
+		         , self.config.incremental
+		         ) for root in roots]
+
+		if jobs == 1:
+			payloads = [_collect_root(task) for task in tasks]
+		else:
+			pool = multiprocessing.Pool(processes=jobs)
+			try:
+				payloads = pool.map(_collect_root, tasks)
+				pool.close()
+			except BaseException:
+				pool.terminate()
+				raise
+			finally:
+				pool.join()
 
 		if self.config.verbose:
 			print("done")
 
-			print("Serialising payload... ", end='')
-			sys.stdout.flush()
+		result = 0
+		for root, payload in zip(roots, payloads):
+			if payload is None:
+				print("Unable to collect the report for '%s'" % root, \
+						file=sys.stderr)
+				result = 1
+				continue
 
-		request_body    = serialize(post_data)
-		request_headers = {'Content-type': 'application/json'}
+			if self.config.verbose:
+				print("\nPreparing the report for '%s' (UUID %s)... " \
+						% (root, payload.payload['AUTH']['UUID']), end='')
+				sys.stdout.flush()
+
+			if self.submit(payload, get_root_dir(self.config.state_dir, root)):
+				result = 1
+
+		return result
+
+	def get_root_payload_file(self, root):
+		"""
+		Returns the payload config of 'root', falling back to the one given on
+		the command line.
+		"""
+
+		return get_root_payload_file(root, self.config.payload)
+
+	def submit(self, payload, state_dir):
+		"""
+		Uploads 'payload' (a report or the changes since the one stored in
+		'state_dir') and returns the exit status.
+		"""
+
+		snapshots = SnapshotStore(
+			os.path.join(state_dir, SNAPSHOT_FILE)
+		)
+		base = None if self.config.full else snapshots.load()
+
+		if base is not None:
+			report = payload.get()
+			with timing.phase('delta'):
+				post_data = make_delta_payload(report, base)
+		elif self.config.verbose >= 2 and not self.config.pretend:
+			# The report is dumped below and then uploaded, so only analyse
+			# the packages once:
+			payload.get()
 
 		if self.config.verbose:
 			print("done")
@@ -149,43 +451,387 @@ class Submit(object):
 
 		if self.config.verbose >= 2:
 			print("Serialised payload:")
-			payload.dump(human=True)
+			if base is not None:
+				print(serialize(post_data, human=True))
+			else:
+				payload.dump(human=True)
 
 		###
 
 		if self.config.pretend:
+			if base is None and self.config.verbose < 2:
+				payload.get()
+
+			self.print_cache_stats(payload)
 			print("Dry run, exiting...")
 			return 0
 
 		###
 
-		if self.config.ssl:
-			conn_class = httplib.HTTPSConnection
+		if self.config.defer:
+			return 0 if self.spool_report(payload, state_dir) else 1
+
+		writer = None
+		delta_rejected = False
+		unchanged = False
+
+		# Only deltas are probed: the hash of a full report isn't known until
+		# it has been streamed.
+		if base is not None and not self.config.no_probe:
+			try:
+				with timing.phase('probe'):
+					status, reason, server_hash = \
+							self.probe(payload, post_data['HASH'])
+			except (httplib.HTTPException, socket.error):
+				# Not fatal, the upload will tell:
+				if self.config.verbose >= 2:
+					print("Note: the probe failed, uploading anyway")
+			else:
+				unchanged = status == httplib.NOT_MODIFIED
+
+				# A delta from another base would be rejected:
+				if not unchanged and server_hash is not None \
+						and server_hash != post_data['BASE']:
+					if self.config.verbose:
+						print("Server doesn't have the last report, sending the full report... ")
+						sys.stdout.flush()
+
+					base = None
+					delta_rejected = True
+
+		try:
+			if unchanged:
+				print('Server response: %s (%s)' % (status, reason))
+				print("The server already has this report")
+			else:
+				if base is not None:
+					if self.config.verbose:
+						print("Sending changes since the last report... ")
+						sys.stdout.flush()
+
+					with timing.phase('serialization'):
+						request_body = serialize(post_data)
+
+					with timing.phase('upload'):
+						status, reason, response_body = self.upload(request_body)
+
+					if status == BASE_REJECTED_STATUS:
+						if self.config.verbose:
+							print("Server doesn't have the last report, sending the full report... ")
+							sys.stdout.flush()
+
+						base = None
+						delta_rejected = True
+
+				if base is None:
+					if self.config.verbose and not delta_rejected:
+						print("Sending report... ")
+						sys.stdout.flush()
+
+					# Write the new snapshot as the report is streamed:
+					writer = snapshots.writer(payload.payload, payload.has_packages)
+					with timing.phase('upload'):
+						status, reason, response_body = self.upload(
+								payload.iter_serialized(on_package=writer.add))
+
+				print('Server response: %s (%s)' % (status, reason))
+				print(response_body)
+		except (httplib.HTTPException, socket.error):
+			if writer is not None:
+				writer.abort()
+
+			sys.stderr.write('Something went wrong\n')
+			self.spool_report(payload, state_dir)
+			return 1
+
+		self.print_cache_stats(payload)
+
+		if not unchanged and not 200 <= status < 300:
+			if writer is not None:
+				writer.abort()
+
+			# Client errors won't go away by retrying:
+			if status >= 500:
+				self.spool_report(payload, state_dir)
+
+			return 1
+
+		# Any spooled report is older than this one:
+		Spool(self.config.spool_dir).remove(payload.payload['AUTH']['UUID'])
+
+		if writer is not None:
+			saved = writer.commit()
 		else:
-			conn_class = httplib.HTTPConnection
+			saved = snapshots.save(payload.get())
+
+		if not saved and self.config.verbose >= 2:
+			print("Note: unable to save the report to '%s'" % snapshots.path)
+
+		return 0
+
+	def probe(self, payload, snapshot_hash):
+		"""
+		Asks the server, with a conditional HEAD request, whether the last
+		report it has of this UUID is the one with the hash 'snapshot_hash'
+		(see delta.py). Returns the status (304 if it is), the reason, and the
+		hash of the server's last report if it says what it is.
+		"""
+
+		auth = payload.payload['AUTH']
+		credentials = ('%s:%s' % (auth['UUID'], auth['PASSWD'])).encode('utf_8')
 
-		conn = conn_class(self.config.server)
+		authorization = base64.b64encode(credentials).decode('ascii')
+
+		request_headers = { 'Authorization': 'Basic ' + authorization
+		                  , 'If-None-Match': '"%s"' % snapshot_hash
+		                  }
+
+		status, reason, _, response_headers = self.get_uploader().request( \
+				'HEAD', self.config.url, request_headers, b'', with_headers=True)
+
+		return status, reason, response_headers.get('etag', '').strip('"') or None
+
+	def spool_report(self, payload, state_dir):
+		"""
+		Spools the full report of 'payload', to be sent by --flush. Returns
+		False if it hasn't been spooled.
+		"""
+
+		if self.config.no_spool:
+			return False
+
+		# Analyse the packages (again, if the upload was interrupted) so that
+		# iter_serialized() doesn't stream them:
+		payload.get()
+		report = b''.join(c.encode('utf_8') if isinstance(c, type(u'')) else c \
+				for c in payload.iter_serialized())
+
+		spool = Spool(self.config.spool_dir)
+		if not spool.put(payload.payload['AUTH']['UUID'], report, state_dir):
+			print("Unable to spool the report to '%s'" % spool.path, file=sys.stderr)
+			return False
+
+		if self.config.verbose:
+			print("The report has been spooled to '%s' (see --flush)" % spool.path)
+
+		return True
+
+	def flush(self):
+		"""
+		Sends the spooled reports that are due, backing off exponentially on
+		the ones that fail. Returns the exit status.
+		"""
+
+		result = 0
+		now = time.time()
+
+		due = []
+		for entry in Spool(self.config.spool_dir):
+			if entry.is_due(now):
+				due.append(entry)
+			elif self.config.verbose >= 2:
+				print("Not sending the report of %s before %s" % (entry.uuid, \
+						time.strftime('%Y-%m-%d %H:%M:%S', \
+								time.localtime(entry.next_attempt))))
+
+		def send(entry):
+			report = entry.read()
+			if report is None:
+				return entry, report, None
+
+			try:
+				return entry, report, self.upload(report)
+			except (httplib.HTTPException, socket.error):
+				return entry, report, (None, 'unable to connect', '')
+
+		# Up to --connections reports are sent at the same time, the results
+		# are handled in order:
+		pool = ThreadPool(max(1, min(self.config.connections, len(due))))
 		try:
+			results = pool.imap(send, due)
+			pool.close()
+		except BaseException:
+			pool.terminate()
+			raise
+
+		for entry, report, response in results:
+			if report is None:
+				continue
+
+			status, reason, response_body = response
+
 			if self.config.verbose:
-				print("Sending report... ")
-				sys.stdout.flush()
+				print("Spooled report of %s:" % entry.uuid)
+
+			if status is None or status >= 500:
+				entry.defer(now)
+				print("Failed (%s), attempt %d, retrying in %d minutes" \
+						% (reason, entry.attempts, get_backoff(entry.attempts) // 60), \
+						file=sys.stderr)
+				result = 1
+				continue
+
+			print('Server response: %s (%s)' % (status, reason))
+			print(response_body)
+			entry.remove()
+
+			if not 200 <= status < 300:
+				result = 1
+			elif entry.state_dir:
+				snapshots = SnapshotStore(
+					os.path.join(entry.state_dir, SNAPSHOT_FILE)
+				)
+				snapshots.save(decode_payload(json.loads(report.decode('utf_8'))))
+
+		pool.join()
+		return result
+
+	def print_cache_stats(self, payload):
+		if self.config.verbose >= 2:
+			print("Package records: %d cached, %d recomputed" \
+					% payload.cache_stats)
 
-			conn.request( 'POST'
-			            , url     = self.config.url
-			            , headers = request_headers
-			            , body    = request_body
-			)
+	def iter_encoded(self, chunks, sizes):
+		"""
+		Encodes, compresses and buffers the text 'chunks' into blocks of about
+		UPLOAD_BLOCK_SIZE bytes. 'sizes' is a list whose first two items are
+		incremented by the raw and the compressed size of the data.
+		"""
 
-			response = conn.getresponse()
-			print('Server response: %s (%s)' % \
-					(response.status, response.reason))
-			print(response.read())
-		except httplib.HTTPException:
-			sys.stderr.write('Something went wrong')
-			return 1
+		compressor = get_compressor(self.config.compress)
+		buffered = []
+		buffered_size = 0
+
+		for chunk in chunks:
+			if isinstance(chunk, type(u'')):
+				chunk = chunk.encode('utf_8')
+
+			buffered.append(chunk)
+			buffered_size += len(chunk)
+
+			if buffered_size >= UPLOAD_BLOCK_SIZE:
+				block = compressor.compress(b''.join(buffered))
+				sizes[0] += buffered_size
+				sizes[1] += len(block)
+
+				buffered = []
+				buffered_size = 0
+
+				if block:
+					yield block
+
+		block = compressor.compress(b''.join(buffered)) + compressor.flush()
+		sizes[0] += buffered_size
+		sizes[1] += len(block)
+
+		if block:
+			yield block
+
+	def upload(self, request_body):
+		"""
+		POSTs 'request_body' to the server and returns (status, reason, body)
+		of the response. 'request_body' is either a string or an iterable of
+		strings, which is sent using chunked transfer encoding.
+		"""
+
+		request_headers = {'Content-type': 'application/json'}
+
+		content_encoding = get_content_encoding(self.config.compress)
+		if content_encoding:
+			request_headers['Content-Encoding'] = content_encoding
+
+		chunked = not isinstance(request_body, (bytes, type(u'')))
+		if not chunked:
+			request_body = [request_body]
+
+		sizes  = [0, 0]
+		blocks = self.iter_encoded(request_body, sizes)
+		if not chunked:
+			blocks = b''.join(blocks)
+
+		if chunked and self.config.pipeline:
+			blocks = prefetch(blocks)
+
+		try:
+			result = self.get_uploader().request('POST', self.config.url, \
+					request_headers, blocks)
 		finally:
-			if conn:
-				conn.close()
+			# If the upload failed, the traceback still refers to the blocks.
+			# Stop generating them (and join the --pipeline producer) before
+			# anything else, e.g. spool_report(), uses the payload:
+			if chunked:
+				blocks.close()
+
+		if content_encoding and self.config.verbose >= 2:
+			print("Compressed report (%s): %d -> %d bytes" \
+					% (self.config.compress, sizes[0], sizes[1]))
+
+		return result
+
+	def get_uploader(self):
+		if self.uploader is None:
+			self.uploader = Uploader( self.config.server
+			                        , use_ssl         = self.config.ssl
+			                        , timeout         = self.config.timeout
+			                        , max_connections = self.config.connections
+			)
+
+		return self.uploader
+
+def get_root_path(root, path):
+	"""
+	Returns the absolute 'path' as seen from inside 'root'.
+	"""
+
+	return os.path.join(root, path.lstrip(os.sep))
+
+def get_root_payload_file(root, path):
+	"""
+	Returns the payload config 'path' inside 'root' if there is one there, or
+	'path' itself.
+	"""
+
+	root_path = get_root_path(root, path)
+	if os.path.exists(root_path):
+		return root_path
+	return path
+
+def get_root_dir(directory, root):
+	"""
+	Returns the subdirectory of 'directory' where the data of 'root' (e.g. its
+	package cache or its last report) is kept.
+	"""
+
+	return os.path.join(directory, 'roots', quote(os.path.realpath(root), safe=''))
+
+def _collect_root(task):
+	"""
+	Returns the analysed Payload of a root, or None on error (which has
+	already been reported).
+	"""
+
+	root, payload_file, auth_file, cache_dir, protocol, jobs, incremental = task
+
+	try:
+		payload = Payload(
+			payload_file=payload_file,
+			auth_file=auth_file,
+			jobs=jobs,
+			cache_dir=cache_dir,
+			protocol=protocol,
+			context=CollectionContext.for_root(root),
+			incremental=incremental
+		)
+		payload.get()
+	except SystemExit:
+		# Payload() exits on configuration errors, which mustn't take down a
+		# worker process (or the other roots):
+		return None
+	except (portage.exception.PortageException, EnvironmentError) as e:
+		print("Error: '%s': %s" % (root, e), file=sys.stderr)
+		return None
+
+	return payload
 
 def main(args, config=Config()):
 	return Submit(config).run(args)
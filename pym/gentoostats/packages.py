@@ -10,7 +10,6 @@ from __future__ import print_function
 import portage
 from portage._sets import SETPREFIX
 from portage._sets import load_default_config
-from gentoolkit.dbapi import VARDB
 
 class Packages(object):
 	"""
@@ -18,55 +17,74 @@ class Packages(object):
 	"""
 
 	@staticmethod
-	def get_installed_CPs():
+	def get_installed_CPs(context=None):
 		"""
-		Read installed packages as category/packagename.
+		Read installed packages as category/packagename. 'context' is the
+		CollectionContext of the system to read (default: the running one).
 		"""
-		return VARDB.cp_all()
+		if context is None:
+			# gentoolkit.dbapi loads portage's trees as it is imported:
+			from gentoolkit.dbapi import VARDB
+			return VARDB.cp_all()
+		return context.vardb.cp_all()
 
 	@staticmethod
-	def get_installed_CPVs():
+	def get_installed_CPVs(context=None):
 		"""
 		Read installed packages as category/packagename-version.
 		"""
-		return VARDB.cpv_all()
+		if context is None:
+			from gentoolkit.dbapi import VARDB
+			return VARDB.cpv_all()
+		return context.vardb.cpv_all()
 
 	@staticmethod
-	def get_set(set_name='world', recursive=True):
+	def get_sets(set_names=('world',), recursive=True, context=None):
 		"""
-		Returns a dictionary containing the given set and all of its
-		atoms/subsets. If recursive is True, this is done recursively.
+		Returns a dictionary containing the given sets and, if recursive is
+		True, all the sets they include (directly or not), with the sorted
+		atoms/subsets of each.
 		"""
 
-		eroot    = portage.settings["EROOT"]
-		trees    = portage.db[eroot]
+		if context is None:
+			trees = portage.db[portage.settings["EROOT"]]
+		else:
+			trees = context.trees
+
 		vartree  = trees["vartree"]
 		settings = vartree.settings
 
-		setconfig = load_default_config(settings=settings, trees=trees)
-		setconfig._parse()
+		psets = load_default_config(settings=settings, trees=trees).getSets()
 
-		# selected sets (includes at least the 'selected' set):
+		# atoms and nonatoms for each set, in a single walk of the graph of
+		# sets (which may have cycles):
 		selected_sets = dict()
-
-		def _include_set(s, recursive=True):
+		pending = list(set_names)
+		while pending:
+			s = pending.pop()
 			if s in selected_sets:
-				return
+				continue
 
-			if s not in setconfig.psets:
+			if s not in psets:
 				raise Exception("Non existent set: " + s)
 
-			atoms    = setconfig.psets[s].getAtoms()
-			nonatoms = setconfig.psets[s].getNonAtoms()
+			atoms    = psets[s].getAtoms()
+			nonatoms = psets[s].getNonAtoms()
 
-			# atoms and nonatoms for each set:
-			selected_sets[s] = list(atoms.union(nonatoms))
 			# (use a list so that it's JSON serializable by default)
+			selected_sets[s] = sorted(atoms.union(nonatoms))
 
-			# recursevely add any sets included by the current set:
 			if recursive:
-				subsets = [x[len(SETPREFIX):] for x in nonatoms if x.startswith(SETPREFIX)]
-				map(_include_set, subsets)
+				pending.extend(x[len(SETPREFIX):] for x in nonatoms \
+						if x.startswith(SETPREFIX))
 
-		_include_set(set_name, recursive=recursive)
 		return selected_sets
+
+	@staticmethod
+	def get_set(set_name='world', recursive=True, context=None):
+		"""
+		Returns a dictionary containing the given set and all of its
+		atoms/subsets. If recursive is True, this is done recursively.
+		"""
+
+		return Packages.get_sets([set_name], recursive, context)
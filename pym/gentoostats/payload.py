@@ -7,60 +7,200 @@
 
 from __future__ import print_function
 
+import os
 import sys
-import pprint
-
-try:
-	import ConfigParser
-except ImportError:
-	import configparser as ConfigParser
+import time
+import multiprocessing
 
 import util
 from packages import Packages
 from metadata import Metadata
 from environment import Environment
+from . import timing
+from .vdb import VDBReader
+from .context import CollectionContext
+from .fields import FieldSelection, ENV_VAR_FIELDS, ENV_LIST_FIELDS
+from .encoding import encode_packages
+from .protocol import PROTOCOL, COMPACT_PROTOCOL
+from .records import PackageRecords
+from .cache import PackageCache, PackageJournal, ValueCache, \
+		PACKAGE_CACHE_FILE, JOURNAL_DIR, SET_CACHE_FILE, ENV_CACHE_FILE, \
+		config_fingerprint, sets_fingerprint, env_fingerprint, entry_key
+
+def get_package_info(metadata, fields):
+	"""
+	Return a dictionary with the given fields (a subsequence of
+	fields.PACKAGE_FIELDS) of a package's metadata.
+	"""
+	getters = { 'REPO':       metadata.get_repo_name
+	          , 'SIZE':       metadata.get_size
+	          , 'KEYWORD':    metadata.get_keyword
+	          , 'BUILD_TIME': metadata.get_build_time
+	          , 'IUSE':       metadata.get_iuse
+	          , 'PKGUSE':     metadata.get_pkguse
+	          , 'USE':        metadata.get_use
+	          }
+
+	# Metadata only computes what is asked for:
+	package_info = dict()
+	for key in fields:
+		package_info[key] = timing.timed_field(key, getters[key])
+
+	return package_info
+
+def iter_analyse_cpvs(cpvs, fields, context, reader=None):
+	"""
+	Yield (cpv, package_info) for the given cpvs, in the same order. If
+	'reader' (a vdb.VDBReader) is given, the metadata are read directly from
+	the vdb.
+	"""
+	for cpv in cpvs:
+		if reader is not None:
+			entry = reader.open_entry(reader.get_path(cpv))
+			metadata = Metadata(cpv, context=context, entry=entry)
+		else:
+			metadata = Metadata(cpv, context=context)
+
+		yield cpv, get_package_info(metadata, fields)
+
+# State of each iter_analyse_parallel() worker process:
+_worker_state = dict()
+
+def _init_worker(fields, reader, root, timed):
+	if timed:
+		timing.enable()
 
-USE_FLAG_TYPES = ['IUSE', 'PKGUSE', 'USE']
+	_worker_state['fields']  = fields
+	_worker_state['reader']  = reader
+	_worker_state['context'] = CollectionContext.for_root(root) if root \
+			else CollectionContext()
+
+def _analyse_shard(cpvs):
+	records = list(iter_analyse_cpvs( cpvs
+	                                , _worker_state['fields']
+	                                , _worker_state['context']
+	                                , _worker_state['reader']
+	))
+
+	# Per-field times are accumulated by the main process:
+	recorder = timing.get_recorder()
+	return records, recorder.take_fields() if recorder else dict()
+
+def iter_analyse_parallel(cpvs, fields, reader, jobs, root=None):
+	"""
+	Like iter_analyse_cpvs(), but shards the cpvs by category across 'jobs'
+	worker processes. The results are yielded in the same order as by
+	iter_analyse_cpvs(). 'root' is the root of the system to analyse (see
+	CollectionContext.for_root()), if it isn't the running one.
+	"""
+	shards = []
+	for cpv in cpvs:
+		category = cpv.split('/', 1)[0]
+		if not shards or shards[-1][0] != category:
+			shards.append((category, []))
+		shards[-1][1].append(cpv)
+
+	pool = multiprocessing.Pool( processes   = jobs
+	                           , initializer = _init_worker
+	                           , initargs    = ( fields, reader, root
+	                                           , timing.get_recorder() is not None
+	                                           )
+	)
+
+	try:
+		# imap() returns the shards in the order they were submitted:
+		for records, field_times in pool.imap(_analyse_shard, [s for _, s in shards]):
+			if field_times:
+				timing.get_recorder().merge_fields(field_times)
+
+			for pair in records:
+				yield pair
+
+		pool.close()
+	except BaseException:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
 
 class Payload(object):
 	"""
 	A class that encapsulates payload operations.
 	"""
 
-	def __init__(self, payload_file, auth_file):
+	def __init__(self, payload_file, auth_file, jobs=1, cache_dir=None, \
+			protocol=PROTOCOL, context=None, packages=None, incremental=False, \
+			payload_config=None):
 		"""
 		Initialize the payload according to the config file.
+
+		@param payload_config The parsed payload config, instead of reading
+		                      'payload_file' (which is then only used in
+		                      messages)
+		@type  payload_config ConfigParser
+
+		@param context The system to report (default: the running one)
+		@type  context CollectionContext
+		@param packages Where to get the package records from instead of
+		                analysing the packages: an object whose
+		                iter_packages() is like Payload.iter_packages() (see
+		                the agent module)
+		@type  packages object
+		@param protocol PROTOCOL, or protocol.COMPACT_PROTOCOL to serialize the
+		                package records compactly
+		@type  protocol int
+		@param jobs Number of processes to use for analysing packages
+		@type  jobs int
+		@param cache_dir Directory for the package cache (None disables it)
+		@type  cache_dir str
+		@param incremental Take the package records from the cache and the
+		                   changes recorded by the portage hook since, see
+		                   get_incremental_records()
+		@type  incremental bool
 		"""
 
-		self.payload = dict()
+		self.payload   = dict()
+		self.jobs      = jobs
+		self.cache_dir = cache_dir
+		self.context   = context
+		self.packages  = packages
+
+		self.incremental = incremental
+
+		# (cached, recomputed) package records of the last analyse_packages():
+		self.cache_stats = (0, 0)
+
+		if payload_config is None:
+			payload_config = util.get_payload_config(payload_file)
+		self.payload_config = payload_config
+		try:
+			self.fields = FieldSelection.from_config(self.payload_config)
+		except ValueError as e:
+			print('Error: Malformed payload config %s: %s' % (payload_file, e), \
+					file=sys.stderr)
+			sys.exit(1)
 
-		self.payload_config = util.get_payload_config(payload_file)
 		self.payload['AUTH'] = util.get_auth_config(auth_file)
-		self.payload['PROTOCOL'] = 2
+		self.payload['PROTOCOL'] = protocol
 		self.generate_payload()
 
-	def is_masked(self, section, item):
+	def __getstate__(self):
 		"""
-		Check the mask status of a payload entry.
+		Payloads are pickled (to be sent between processes) without their
+		context, so only a payload whose packages have been analysed (see
+		get()) can be used after unpickling.
 		"""
-		try:
-			return not self.payload_config.getboolean(section, item)
-		except ConfigParser.NoOptionError:
-			return False
-		except (ConfigParser.NoSectionError, ValueError):
-			sys.stderr.write('Malformed payload config')
-			sys.exit(1)
+		state = dict(self.__dict__)
+		state['context'] = None
+		state['packages'] = None
+		state['payload_config'] = None
+		return state
 
-	def any_one_is_enabled(self, config_section, keys):
+	def is_masked(self, section, item):
 		"""
-		Check if any one of the keys in the given section is enabled (not
-		masked).
+		Check the mask status of a payload entry.
 		"""
-		for k in keys:
-			if not self.is_masked(config_section, k):
-				return True
-
-		return False
+		return not self.fields.is_enabled(section, item)
 
 	def set_data(self, the_dict, config_section, key, generator, *generator_args):
 		"""
@@ -70,70 +210,309 @@ class Payload(object):
 		if not self.is_masked(config_section, key):
 			the_dict[key] = generator(*generator_args)
 
-	def analyse_packages(self):
+	def iter_packages(self):
 		"""
-		Generate information about all the installed packages.
+		Yield (cpv, package_info) for all the installed packages, sorted by
+		cpv. Records are computed (or read from the cache) as they are needed,
+		so the caller doesn't have to keep them all in memory.
 		"""
-		section = 'PACKAGES'
-		self.payload['PACKAGES'] = dict()
+		fields  = self.fields.packages
 
-		for cpv in Packages.get_installed_CPVs():
-			metadata = Metadata(cpv)
-			package_info = dict()
+		if self.packages is not None:
+			for cpv, package_info in self.packages.iter_packages():
+				yield cpv, package_info
 
-			self.set_data(package_info, section, 'REPO',       metadata.get_repo_name)
-			self.set_data(package_info, section, 'SIZE',       metadata.get_size)
-			self.set_data(package_info, section, 'KEYWORD',    metadata.get_keyword)
-			self.set_data(package_info, section, 'BUILD_TIME', metadata.get_build_time)
+			self.cache_stats = self.packages.cache_stats
+			return
 
-			if self.any_one_is_enabled(section, USE_FLAG_TYPES):
-				# TODO: make this lazier
-				use_flags = metadata.get_use_flag_information()
+		with timing.phase('package list'):
+			context = self.context or CollectionContext()
+			reader  = VDBReader(context.vdb_path)
 
-				for key in USE_FLAG_TYPES:
-					self.set_data(package_info, section, key, lambda: use_flags[key])
+		if self.incremental and self.cache_dir and reader.is_available():
+			records = self.get_incremental_records(context, reader, fields)
+			if records is not None:
+				for pair in records:
+					yield pair
+				return
 
-			self.payload['PACKAGES'][cpv] = package_info
+		# Changes recorded by the portage hook until now are superseded by
+		# this run:
+		started = time.time()
+
+		with timing.phase('package list'):
+			if reader.is_available():
+				cpvs = [cpv for cpv, _ in reader.iter_cpvs()]
+			else:
+				reader = None
+				cpvs = list(Packages.get_installed_CPVs(self.context))
+
+			# Sort by the full cpv, which is the order util.serialize(human=True)
+			# would use (note that 'a-b/x' < 'a/x').
+			cpvs.sort()
+
+		cache   = None
+		keys    = dict()
+		cached  = set()
+		missing = cpvs
+		if self.cache_dir and reader is not None:
+			with timing.phase('package cache'):
+				cache = PackageCache(
+					os.path.join(self.cache_dir, PACKAGE_CACHE_FILE),
+					config_fingerprint(context.settings, list(fields))
+				)
+				cache.load()
+
+				missing = []
+				for cpv in cpvs:
+					keys[cpv] = entry_key(reader.get_path(cpv))
+					if cache.has(cpv, keys[cpv]):
+						cached.add(cpv)
+					else:
+						missing.append(cpv)
+
+		if self.jobs > 1 and len(missing) > 1:
+			computed = iter_analyse_parallel(missing, fields, reader, \
+					self.jobs, context.root)
+		else:
+			computed = iter_analyse_cpvs(missing, fields, context, reader)
+
+		# 'missing' is a subsequence of 'cpvs', so the computed records come
+		# in the right order:
+		for cpv in cpvs:
+			if cpv in cached:
+				# Only decoded now, so that they aren't all in memory:
+				yield cpv, cache.get_record(cpv)
+				continue
+
+			with timing.phase('package metadata'):
+				computed_cpv, record = next(computed)
+			if cache is not None:
+				cache.set(cpv, keys[cpv], record)
+
+			yield computed_cpv, record
+
+		self.cache_stats = (len(cpvs) - len(missing), len(missing))
+
+		if cache is not None:
+			with timing.phase('package cache'):
+				cache.prune(cpvs)
+				if cache.save():
+					journal = PackageJournal(os.path.join(self.cache_dir, JOURNAL_DIR))
+					journal.discard(journal.get_names(before=started))
+
+	def get_incremental_records(self, context, reader, fields):
+		"""
+		Returns an iterator over the sorted (cpv, package_info) of all the
+		installed packages, taken from the package cache updated with the
+		changes that the portage hook has recorded since (see the hook
+		module), or None if there is no usable cache. The vdb is still listed
+		and the key (see cache.entry_key) of every entry is checked against
+		the cached one, so that packages merged, rebuilt or unmerged without
+		the hook are noticed too. Only those and the packages whose change
+		couldn't be used are analysed.
+		"""
+
+		with timing.phase('package cache'):
+			fingerprint = config_fingerprint(context.settings, list(fields))
+			cache = PackageCache(
+				os.path.join(self.cache_dir, PACKAGE_CACHE_FILE), fingerprint
+			)
+			if not cache.load():
+				return None
+
+			journal = PackageJournal(os.path.join(self.cache_dir, JOURNAL_DIR))
+			names   = journal.get_names()
+
+			# Packages whose recorded change can't be used as is:
+			changed = set()
+			for name in names:
+				change = journal.read(name)
+				if change is None:
+					continue
+
+				cpv = change['CPV']
+				if change.get('RECORD') is None:
+					cache.remove(cpv)
+					changed.discard(cpv)
+				elif change.get('FINGERPRINT') != fingerprint:
+					# Computed under another configuration:
+					changed.add(cpv)
+				else:
+					cache.set(cpv, change.get('KEY'), change['RECORD'])
+					changed.discard(cpv)
+
+		with timing.phase('package list'):
+			cpvs = reader.list_cpvs()
+
+			# E.g. a same-cpv rebuild (USE change) without the hook:
+			for cpv in cpvs:
+				if not cache.has(cpv, entry_key(reader.get_path(cpv))):
+					changed.add(cpv)
+
+		for cpv in set(cache.keys) - cpvs:
+			cache.remove(cpv)
+
+		missing = sorted(changed & cpvs)
+		if self.jobs > 1 and len(missing) > 1:
+			computed = iter_analyse_parallel(missing, fields, reader, \
+					self.jobs, context.root)
+		else:
+			computed = iter_analyse_cpvs(missing, fields, context, reader)
+
+		with timing.phase('package metadata'):
+			for cpv, record in computed:
+				cache.set(cpv, entry_key(reader.get_path(cpv)), record)
+
+		with timing.phase('package cache'):
+			# Only forget the changes once they are safely in the cache:
+			if cache.save():
+				journal.discard(names)
+
+		self.cache_stats = (len(cpvs) - len(missing), len(missing))
+		return ((cpv, cache.get_record(cpv)) for cpv in sorted(cpvs))
+
+	def analyse_packages(self):
+		"""
+		Generate information about all the installed packages. The records
+		are kept packed (see records.PackageRecords).
+		"""
+		self.payload['PACKAGES'] = PackageRecords(self.fields.packages, \
+				self.iter_packages())
 
 	def generate_payload(self):
 		"""
 		Generate self.payload.
 		"""
 
-		env = Environment()
+		with timing.phase('environment'):
+			self.payload.update(self.get_env())
 
-		self.set_data(self.payload, 'ENV', 'PLATFORM', env.get_platform)
-		self.set_data(self.payload, 'ENV', 'LASTSYNC', env.get_last_sync)
-		self.set_data(self.payload, 'ENV', 'PROFILE', env.get_profile)
+		# Only bother calling get_installed_CPVs() if any package field is
+		# enabled (the packages themselves are analysed lazily, see get() and
+		# iter_serialized()):
+		self.has_packages = bool(self.fields.packages)
 
-		for var in ['ARCH', 'CHOST', 'CTARGET', 'CFLAGS', 'CXXFLAGS', 'FFLAGS',
-				'LDFLAGS', 'ACCEPT_LICENSE', 'MAKEOPTS', 'EMERGE_DEFAULT_OPTS',
-				'PORTAGE_RSYNC_EXTRA_OPTS', 'SYNC', 'LANG']:
-			self.set_data(self.payload, 'ENV', var, env.get_var, var)
+		with timing.phase('world set'):
+			self.set_data(self.payload, 'PACKAGES', 'WORLDSET', self.get_sets, \
+					["world"])
 
-		for var in ['ACCEPT_KEYWORDS', 'GENTOO_MIRRORS', 'FEATURES', 'USE']:
-			self.set_data(self.payload, 'ENV', var, lambda x: env.get_var(x).split(), var)
+	def get_env(self):
+		"""
+		Return the enabled ENV values, from the ENV cache if nothing that they
+		are computed from has changed since it was written (see
+		cache.env_fingerprint()).
+		"""
+		env = Environment(self.context.settings if self.context else None)
 
-		# Only bother calling get_installed_CPVs() if any of the following is
-		# enabled:
-		if self.any_one_is_enabled('PACKAGES',
-				['BUILD_TIME', 'KEYWORD', 'REPO',
-				'SIZE', 'IUSE', 'PKGUSE', 'USE']):
-			self.analyse_packages()
+		if not self.cache_dir:
+			return self.collect_env(env)
+
+		cache = ValueCache(
+			os.path.join(self.cache_dir, ENV_CACHE_FILE),
+			env_fingerprint(env.settings, self.fields.env)
+		)
+
+		values = cache.load()
+		if values is None:
+			values = self.collect_env(env)
+			cache.save(values)
+
+		return values
 
-		self.set_data(self.payload, 'PACKAGES', 'WORLDSET', Packages.get_set, "world")
+	def collect_env(self, env):
+		"""
+		Return the enabled ENV values, read from the Environment 'env'.
+		"""
+		values = dict()
+
+		self.set_data(values, 'ENV', 'PLATFORM', env.get_platform)
+		self.set_data(values, 'ENV', 'LASTSYNC', env.get_last_sync)
+		self.set_data(values, 'ENV', 'PROFILE', env.get_profile)
+
+		for var in ENV_VAR_FIELDS:
+			self.set_data(values, 'ENV', var, env.get_var, var)
+
+		for var in ENV_LIST_FIELDS:
+			self.set_data(values, 'ENV', var, lambda x: env.get_var(x).split(), var)
+
+		return values
+
+	def get_sets(self, set_names):
+		"""
+		Return the given sets and all the sets they include (see
+		Packages.get_sets()), from the set cache if nothing that they are
+		resolved from has changed since it was written.
+		"""
+		if not self.cache_dir:
+			return Packages.get_sets(set_names, True, self.context)
+
+		context = self.context or CollectionContext()
+		cache = ValueCache(
+			os.path.join(self.cache_dir, SET_CACHE_FILE),
+			sets_fingerprint(context.settings, set_names)
+		)
+
+		sets = cache.load()
+		if sets is None:
+			sets = Packages.get_sets(set_names, True, self.context)
+			cache.save(sets)
+
+		return sets
 
 	def get(self):
 		"""
-		Return currently read payload.
+		Return the payload, analysing the installed packages if that hasn't
+		been done yet.
 		"""
+		if self.has_packages and 'PACKAGES' not in self.payload:
+			self.analyse_packages()
+
 		return self.payload
 
-	def dump(self, human=False):
+	def iter_serialized(self, human=False, on_package=None):
+		"""
+		Serialize the payload incrementally, see util.iter_serialize(). Unless
+		get() has already been called, the package records are generated as
+		the output is consumed. Unlike get(), this honours the compact
+		encoding of protocol 4.
+
+		@param on_package Called with (cpv, package_info) for every package
+		@type  on_package function
+		"""
+		obj = dict(self.payload)
+
+		if self.has_packages:
+			if 'PACKAGES' in obj:
+				# Expanded one at a time:
+				records  = obj['PACKAGES']
+				packages = ((cpv, records[cpv]) for cpv in sorted(records))
+			else:
+				packages = self.iter_packages()
+
+			if on_package is not None:
+				packages = _tee_packages(packages, on_package)
+
+			if obj['PROTOCOL'] == COMPACT_PROTOCOL:
+				obj['PACKAGES'] = encode_packages(packages, self.fields.packages)
+			else:
+				obj['PACKAGES'] = util.StreamingDict(packages)
+
+		return timing.timed_iter('serialization', \
+				util.iter_serialize(obj, human=human))
+
+	def dump(self, human=False, stream=sys.stdout):
 		"""
 		Dump payload.
 		"""
-		if human:
-			pprint.pprint(self.payload)
-		else:
-			print(self.payload)
+		for chunk in self.iter_serialized(human=human):
+			if not isinstance(chunk, str):
+				# Python 2 and a unicode chunk:
+				chunk = chunk.encode('utf_8')
+			stream.write(chunk)
+		stream.write('\n')
+
+def _tee_packages(packages, callback):
+	for cpv, package_info in packages:
+		callback(cpv, package_info)
+		yield cpv, package_info
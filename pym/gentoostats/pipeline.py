@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Pipelined uploads (submit --pipeline).
+
+A producer thread generates the report (analysing the packages as it goes),
+encodes and compresses it, and feeds the blocks into a bounded queue, while
+the uploading thread sends them. Collection and upload therefore overlap, and
+the queue bounds the memory used when the network is slower than the
+collection.
+"""
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+import threading
+
+# Number of (UPLOAD_BLOCK_SIZE) blocks that may be waiting to be sent:
+QUEUE_BLOCKS = 16
+
+# How often (in seconds) blocked threads check whether to give up. Python 2
+# can't interrupt Queue.get() without a timeout, e.g. on ^C.
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+class _Failure(object):
+	def __init__(self, exc):
+		self.exc = exc
+
+def _produce(items, blocks, stopped):
+	"""
+	Runs in the producer thread: puts every block of 'blocks' into 'items',
+	then _END (or a _Failure).
+	"""
+
+	def put(item):
+		while not stopped.is_set():
+			try:
+				items.put(item, timeout=POLL_INTERVAL)
+				return True
+			except queue.Full:
+				pass
+
+		return False
+
+	try:
+		for block in blocks:
+			if not put(block):
+				return
+		put(_END)
+	except Exception as e:
+		put(_Failure(e))
+	finally:
+		# Run the cleanup of 'blocks' in this thread, before it is joined:
+		close = getattr(blocks, 'close', None)
+		if close is not None:
+			close()
+
+def prefetch(blocks, queue_size=QUEUE_BLOCKS):
+	"""
+	Yields the items of the iterable 'blocks', which are produced ahead (up to
+	'queue_size' of them) by a separate thread. Exceptions raised while
+	producing them are raised here. Closing this generator stops the producer
+	and waits for it to finish.
+	"""
+
+	items   = queue.Queue(maxsize=queue_size)
+	stopped = threading.Event()
+
+	producer = threading.Thread(target=_produce, args=(items, blocks, stopped))
+	producer.daemon = True
+	producer.start()
+
+	try:
+		while True:
+			try:
+				item = items.get(timeout=POLL_INTERVAL)
+			except queue.Empty:
+				continue
+
+			if item is _END:
+				break
+			if isinstance(item, _Failure):
+				raise item.exc
+
+			yield item
+	finally:
+		stopped.set()
+		producer.join()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+The versions of the report protocol. Kept free of dependencies, so that
+importing them (e.g. in the receive module) doesn't load portage.
+"""
+
+# Plain reports, and the default:
+PROTOCOL = 2
+
+# Changes since the last acknowledged report (see delta.py):
+DELTA_PROTOCOL = 3
+
+# Compact encoding of the packages (see encoding.py):
+COMPACT_PROTOCOL = 4
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Compact in-memory storage of package records.
+
+A package record (see payload.get_package_info()) is a dict of a few strings
+and up to three lists of USE flags, which takes a few KiB per package. Here
+each record is a tuple of the values of the selected fields instead:
+
+	* REPO and KEYWORD are strings from a pool shared by all the records, so
+	  each distinct value is only kept once.
+	* IUSE, PKGUSE and USE are arrays of indices into the pool (or () if they
+	  are empty).
+	* SIZE and BUILD_TIME are unchanged.
+
+Records are only expanded back into dicts when they are looked up, e.g. one
+at a time as the report is serialized.
+"""
+
+from __future__ import print_function
+
+from array import array
+
+try:
+	from collections.abc import Mapping
+except ImportError:
+	from collections import Mapping
+
+from .encoding import StringTable, STRING_FIELDS
+from .fields import USE_FLAG_TYPES
+
+# Item type of the flag arrays (unsigned int):
+INDEX_TYPECODE = 'I'
+
+# How the value of each field is packed:
+PLAIN, STRING, FLAGS = range(3)
+
+def get_kind(field):
+	if field in USE_FLAG_TYPES:
+		return FLAGS
+	if field in STRING_FIELDS:
+		return STRING
+	return PLAIN
+
+class PackageRecords(Mapping):
+	"""
+	A read-only {cpv: package_info} mapping, plus add() and remove(), that
+	keeps the records packed (see above). Iteration is in cpv order, and
+	items() and values() expand the records one at a time.
+	"""
+
+	def __init__(self, fields, pairs=()):
+		"""
+		@param fields Keys of every package_info (see fields.PACKAGE_FIELDS)
+		@type  fields tuple
+		@param pairs (cpv, package_info) pairs to add
+		@type  pairs iterable
+		"""
+
+		self.fields  = tuple(fields)
+		self.kinds   = tuple(get_kind(field) for field in self.fields)
+		self.table   = StringTable()
+		self.records = dict()
+
+		for cpv, package_info in pairs:
+			self.add(cpv, package_info)
+
+	def _pack_flags(self, flags):
+		if not flags:
+			return ()
+
+		# Nearly all the flags are already in the table:
+		indices = self.table.indices
+		try:
+			return array(INDEX_TYPECODE, [indices[flag] for flag in flags])
+		except KeyError:
+			return array(INDEX_TYPECODE, [self.table.index(flag) for flag in flags])
+
+	def pack(self, package_info):
+		"""
+		Returns the packed form of 'package_info'.
+		"""
+
+		index   = self.table.index
+		strings = self.table.strings
+
+		record = []
+		for field, kind in zip(self.fields, self.kinds):
+			value = package_info[field]
+
+			if kind == FLAGS:
+				value = self._pack_flags(value)
+			elif kind == STRING:
+				value = strings[index(value)]
+
+			record.append(value)
+
+		return tuple(record)
+
+	def unpack(self, record):
+		"""
+		Reverses pack().
+		"""
+
+		strings = self.table.strings
+
+		package_info = dict()
+		for field, kind, value in zip(self.fields, self.kinds, record):
+			if kind == FLAGS:
+				value = [strings[i] for i in value]
+
+			package_info[field] = value
+
+		return package_info
+
+	def add(self, cpv, package_info):
+		self.records[cpv] = self.pack(package_info)
+
+	def remove(self, cpv):
+		self.records.pop(cpv, None)
+
+	def __getitem__(self, cpv):
+		return self.unpack(self.records[cpv])
+
+	def __contains__(self, cpv):
+		return cpv in self.records
+
+	def __iter__(self):
+		return iter(sorted(self.records))
+
+	def __len__(self):
+		return len(self.records)
+
+	def items(self):
+		for cpv in self:
+			yield cpv, self.unpack(self.records[cpv])
+
+	def values(self):
+		for _, package_info in self.items():
+			yield package_info
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Spool of reports that couldn't be uploaded (or were deferred on purpose).
+
+Each pending report is kept as two files named after the UUID it belongs to:
+
+	<uuid>.json   the serialized report
+	<uuid>.state  {'ATTEMPTS': n, 'NEXT_ATTEMPT': t, 'STATE_DIR': d}
+
+so spooling a report replaces any older pending report of the same UUID:
+after an outage only the newest report of each system is sent.
+"""
+
+from __future__ import print_function
+
+try:
+	from urllib import quote, unquote
+except ImportError:
+	from urllib.parse import quote, unquote
+
+import io
+import os
+import json
+import time
+
+from .util import atomic_write
+
+DEFAULT_SPOOL_DIR = '/var/spool/gentoostats'
+
+REPORT_SUFFIX = '.json'
+STATE_SUFFIX  = '.state'
+
+# Delay before the first retry, doubled after each failed attempt:
+BACKOFF_BASE = 5 * 60
+BACKOFF_MAX  = 24 * 60 * 60
+
+def get_backoff(attempts):
+	"""
+	Returns the delay (in seconds) before the next attempt after 'attempts'
+	failed ones.
+
+	>>> [get_backoff(n) for n in range(4)]
+	[0, 300, 600, 1200]
+	>>> get_backoff(100) == BACKOFF_MAX
+	True
+	"""
+
+	if attempts <= 0:
+		return 0
+	return min(BACKOFF_BASE * 2 ** min(attempts - 1, 32), BACKOFF_MAX)
+
+class SpooledReport(object):
+	"""
+	A pending report. 'state_dir' is where the snapshot of the report goes
+	once it has been acknowledged (see delta.SnapshotStore).
+	"""
+
+	def __init__(self, spool, uuid, attempts=0, next_attempt=0, state_dir=None):
+		self.spool        = spool
+		self.uuid         = uuid
+		self.attempts     = attempts
+		self.next_attempt = next_attempt
+		self.state_dir    = state_dir
+
+	def is_due(self, now=None):
+		return self.next_attempt <= (time.time() if now is None else now)
+
+	def read(self):
+		"""
+		Returns the serialized report (bytes), or None if it has disappeared.
+		"""
+
+		try:
+			with open(self.spool.get_path(self.uuid, REPORT_SUFFIX), 'rb') as f:
+				return f.read()
+		except (IOError, OSError):
+			return None
+
+	def defer(self, now=None):
+		"""
+		Records a failed attempt and schedules the next one.
+		"""
+
+		self.attempts    += 1
+		self.next_attempt = (time.time() if now is None else now) \
+				+ get_backoff(self.attempts)
+		return self.spool.write_state(self)
+
+	def remove(self):
+		self.spool.remove(self.uuid)
+
+class Spool(object):
+	"""
+	A directory of pending reports, at most one per UUID.
+	"""
+
+	def __init__(self, path=DEFAULT_SPOOL_DIR):
+		self.path = path
+
+	def get_path(self, uuid, suffix):
+		return os.path.join(self.path, quote(uuid, safe='') + suffix)
+
+	def put(self, uuid, report, state_dir=None):
+		"""
+		Spools the serialized 'report' of 'uuid', replacing any pending one.
+		Returns False on error.
+		"""
+
+		# Reports contain the password:
+		if not atomic_write(self.get_path(uuid, REPORT_SUFFIX), report, mode=0o600):
+			return False
+
+		return self.write_state(SpooledReport(self, uuid, state_dir=state_dir))
+
+	def write_state(self, entry):
+		state = { 'ATTEMPTS':     entry.attempts
+		        , 'NEXT_ATTEMPT': entry.next_attempt
+		        , 'STATE_DIR':    entry.state_dir
+		        }
+		return atomic_write(self.get_path(entry.uuid, STATE_SUFFIX), \
+				json.dumps(state, sort_keys=True), mode=0o600)
+
+	def get(self, uuid):
+		"""
+		Returns the SpooledReport of 'uuid', or None.
+		"""
+
+		if not os.path.exists(self.get_path(uuid, REPORT_SUFFIX)):
+			return None
+
+		try:
+			with io.open(self.get_path(uuid, STATE_SUFFIX), encoding='utf_8') as f:
+				state = json.load(f)
+
+			return SpooledReport( self, uuid
+			                    , attempts     = int(state['ATTEMPTS'])
+			                    , next_attempt = float(state['NEXT_ATTEMPT'])
+			                    , state_dir    = state['STATE_DIR']
+			)
+		except (IOError, OSError, ValueError, KeyError, TypeError):
+			# Not written yet or damaged, try it as soon as possible:
+			return SpooledReport(self, uuid)
+
+	def __iter__(self):
+		"""
+		Yields the pending reports, by UUID.
+		"""
+
+		try:
+			names = sorted(os.listdir(self.path))
+		except OSError:
+			return
+
+		for name in names:
+			if name.endswith(REPORT_SUFFIX) and not name.startswith('.'):
+				entry = self.get(unquote(name[:-len(REPORT_SUFFIX)]))
+				if entry is not None:
+					yield entry
+
+	def remove(self, uuid):
+		"""
+		Drops the pending report of 'uuid', if any.
+		"""
+
+		for suffix in (REPORT_SUFFIX, STATE_SUFFIX):
+			try:
+				os.unlink(self.get_path(uuid, suffix))
+			except OSError:
+				pass
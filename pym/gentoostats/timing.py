@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Per-phase timing of a run (see the global --timings option).
+
+Recording is off by default, in which case phase() and timed_iter() cost next
+to nothing. Phases may nest: because reports are streamed, the package
+metadata are computed while the report is being serialized and uploaded, so
+every phase is reported both inclusive and exclusive ("self") of the phases
+nested in it.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import itertools
+
+try:
+	_cpu_time = time.process_time
+except AttributeError:
+	_cpu_time = time.clock
+
+class _Entry(object):
+	__slots__ = ('wall', 'cpu', 'self_wall', 'self_cpu', 'calls')
+
+	def __init__(self):
+		self.wall = self.cpu = self.self_wall = self.self_cpu = 0.0
+		self.calls = 0
+
+class _Phase(object):
+	def __init__(self, recorder, name):
+		self.recorder = recorder
+		self.name     = name
+
+	def __enter__(self):
+		# [wall, cpu, wall of nested phases, cpu of nested phases]:
+		self.recorder.stack.append([time.time(), _cpu_time(), 0.0, 0.0])
+		return self
+
+	def __exit__(self, *exc_info):
+		self.recorder.stop(self.name)
+		return False
+
+class _NullPhase(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+_NULL_PHASE = _NullPhase()
+
+class Recorder(object):
+	"""
+	Accumulates the time spent in each phase, and in each package field.
+	"""
+
+	def __init__(self):
+		self.phases = dict()
+		self.order  = []
+		self.stack  = []
+		self.fields = dict()
+
+	def _entry(self, table, name, order=None):
+		try:
+			return table[name]
+		except KeyError:
+			if order is not None:
+				order.append(name)
+			entry = table[name] = _Entry()
+			return entry
+
+	def phase(self, name):
+		return _Phase(self, name)
+
+	def stop(self, name):
+		start_wall, start_cpu, nested_wall, nested_cpu = self.stack.pop()
+		wall = time.time() - start_wall
+		cpu  = _cpu_time() - start_cpu
+
+		entry = self._entry(self.phases, name, self.order)
+		entry.wall      += wall
+		entry.cpu       += cpu
+		entry.self_wall += wall - nested_wall
+		entry.self_cpu  += cpu - nested_cpu
+		entry.calls     += 1
+
+		if self.stack:
+			self.stack[-1][2] += wall
+			self.stack[-1][3] += cpu
+
+	def add_field(self, field, wall, cpu, calls=1):
+		entry = self._entry(self.fields, field)
+		entry.wall  += wall
+		entry.cpu   += cpu
+		entry.calls += calls
+
+	def take_fields(self):
+		"""
+		Returns and resets the field times as {field: (wall, cpu, calls)}, e.g.
+		to send them from a worker process to the main one.
+		"""
+
+		fields = dict((k, (e.wall, e.cpu, e.calls)) for k, e in self.fields.items())
+		self.fields = dict()
+		return fields
+
+	def merge_fields(self, fields):
+		for field, (wall, cpu, calls) in fields.items():
+			self.add_field(field, wall, cpu, calls)
+
+	def print_summary(self, stream=sys.stderr):
+		row = '%-24s %10s %10s %10s %10s %8s'
+		print(row % ('Phase', 'Wall', 'CPU', 'Self wall', 'Self CPU', 'Calls'), \
+				file=stream)
+
+		for name in self.order:
+			e = self.phases[name]
+			print(row % ( name
+			            , '%.3fs' % e.wall,      '%.3fs' % e.cpu
+			            , '%.3fs' % e.self_wall, '%.3fs' % e.self_cpu
+			            , e.calls
+			), file=stream)
+
+		if self.fields:
+			print('', file=stream)
+			print('%-24s %10s %10s %10s' % ('Field (all packages)', 'Wall', \
+					'CPU', 'Calls'), file=stream)
+
+			for name, e in sorted(self.fields.items(), key=lambda x: -x[1].wall):
+				print('%-24s %10s %10s %10s' % ( name
+				                               , '%.3fs' % e.wall
+				                               , '%.3fs' % e.cpu
+				                               , e.calls
+				), file=stream)
+
+_recorder = None
+
+def enable():
+	"""
+	Starts recording (in this process and in processes forked from it).
+	"""
+
+	global _recorder
+	if _recorder is None:
+		_recorder = Recorder()
+	return _recorder
+
+def get_recorder():
+	"""
+	Returns the Recorder, or None if recording is off.
+	"""
+
+	return _recorder
+
+def phase(name):
+	"""
+	Returns a context manager that times the phase 'name'.
+	"""
+
+	if _recorder is None:
+		return _NULL_PHASE
+	return _recorder.phase(name)
+
+def timed_iter(name, iterable, batch=256):
+	"""
+	Times the production of the items of 'iterable' as the phase 'name'.
+	Items are produced 'batch' at a time to keep the overhead down.
+	"""
+
+	if _recorder is None:
+		return iterable
+	return _iter_timed(_recorder, name, iterable, batch)
+
+def _iter_timed(recorder, name, iterable, batch):
+	iterator = iter(iterable)
+	while True:
+		with recorder.phase(name):
+			items = list(itertools.islice(iterator, batch))
+
+		for item in items:
+			yield item
+
+		if len(items) < batch:
+			return
+
+def timed_field(field, getter):
+	"""
+	Calls 'getter' and adds its time to the cumulative time of the package
+	field 'field'.
+	"""
+
+	if _recorder is None:
+		return getter()
+
+	wall = time.time()
+	cpu  = _cpu_time()
+	try:
+		return getter()
+	finally:
+		_recorder.add_field(field, time.time() - wall, _cpu_time() - cpu)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+HTTP(S) requests over persistent connections.
+
+An Uploader keeps the connections to its server open between requests
+(HTTP/1.1 keep-alive), so several reports (e.g. spooled ones, or those of
+several roots) cost a single TCP and TLS handshake.
+"""
+
+from __future__ import print_function
+
+try:
+	import httplib
+except ImportError:
+	import http.client as httplib
+
+import time
+import select
+import socket
+import threading
+
+try:
+	import ssl
+except ImportError:
+	ssl = None
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_CONNECTIONS = 4
+
+# Idle connections are not reused after this many seconds, as the server has
+# probably closed them by then:
+IDLE_TIMEOUT = 5
+
+# A streamed (chunked) body can't be sent again if the connection turns out to
+# have been closed, so those only reuse connections idle for less than this:
+STREAM_IDLE_TIMEOUT = 2
+
+def _is_dropped(conn):
+	"""
+	Returns True if the idle connection 'conn' is readable, i.e. the server
+	has closed it (or sent something unexpected).
+	"""
+
+	sock = conn.sock
+	if sock is None:
+		return True
+
+	try:
+		return bool(select.select([sock], [], [], 0)[0])
+	except (select.error, socket.error, ValueError):
+		return True
+
+class Uploader(object):
+	"""
+	Sends requests to 'server' ('host:port') over up to 'max_connections'
+	persistent connections. It can be shared between threads.
+	"""
+
+	def __init__(self, server, use_ssl=True, timeout=DEFAULT_TIMEOUT, \
+			max_connections=DEFAULT_MAX_CONNECTIONS):
+		self.server  = server
+		self.use_ssl = use_ssl
+		self.timeout = timeout
+
+		self.ssl_context = None
+		if use_ssl and hasattr(ssl, 'create_default_context'):
+			self.ssl_context = ssl.create_default_context()
+
+		self._idle  = []
+		self._lock  = threading.Lock()
+		self._slots = threading.BoundedSemaphore(max_connections)
+
+		# Statistics:
+		self.connections = 0
+		self.requests    = 0
+
+	def _connect(self):
+		if not self.use_ssl:
+			conn = httplib.HTTPConnection(self.server, timeout=self.timeout)
+		elif self.ssl_context is not None:
+			conn = httplib.HTTPSConnection( self.server
+			                              , timeout = self.timeout
+			                              , context = self.ssl_context
+			)
+		else:
+			# Python < 2.7.9:
+			conn = httplib.HTTPSConnection(self.server, timeout=self.timeout)
+
+		with self._lock:
+			self.connections += 1
+		return conn
+
+	def _get_connection(self, max_idle=IDLE_TIMEOUT):
+		"""
+		Returns (connection, reused). Idle connections are only reused if
+		they have been idle for less than 'max_idle' seconds and the server
+		hasn't closed them.
+		"""
+
+		now = time.time()
+		with self._lock:
+			while self._idle:
+				conn, since = self._idle.pop()
+				if now - since < max_idle and not _is_dropped(conn):
+					return conn, True
+				conn.close()
+
+		return self._connect(), False
+
+	def _send(self, conn, method, url, headers, body):
+		if isinstance(body, bytes):
+			conn.request(method, url, body=body, headers=headers)
+		else:
+			conn.putrequest(method, url)
+			for header, value in headers.items():
+				conn.putheader(header, value)
+			conn.putheader('Transfer-Encoding', 'chunked')
+			conn.endheaders()
+
+			for block in body:
+				conn.send(('%x\r\n' % len(block)).encode('ascii') + block + b'\r\n')
+			conn.send(b'0\r\n\r\n')
+
+		response = conn.getresponse()
+		data = response.read()
+
+		response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+		return response.status, response.reason, data, response_headers, \
+				not response.will_close
+
+	def request(self, method, url, headers, body, with_headers=False):
+		"""
+		Sends a request and returns (status, reason, body) of the response,
+		followed by its headers (with lowercase names) if 'with_headers' is
+		True. 'body' is either bytes or an iterable of bytes, which is sent
+		using chunked transfer encoding. Raises httplib.HTTPException or
+		socket.error.
+		"""
+
+		self._slots.acquire()
+		try:
+			streamed = not isinstance(body, bytes)
+			conn, reused = self._get_connection( \
+					STREAM_IDLE_TIMEOUT if streamed else IDLE_TIMEOUT)
+			try:
+				status, reason, data, response_headers, keep_alive = \
+						self._send(conn, method, url, headers, body)
+			except (httplib.HTTPException, socket.error):
+				conn.close()
+
+				# The server may have dropped an idle connection; a streamed
+				# body can't be sent again though.
+				if not reused or streamed:
+					raise
+
+				conn = self._connect()
+				try:
+					status, reason, data, response_headers, keep_alive = \
+							self._send(conn, method, url, headers, body)
+				except (httplib.HTTPException, socket.error):
+					conn.close()
+					raise
+
+			with self._lock:
+				self.requests += 1
+				if keep_alive:
+					self._idle.append((conn, time.time()))
+			if not keep_alive:
+				conn.close()
+
+			if with_headers:
+				return status, reason, data, response_headers
+			return status, reason, data
+		finally:
+			self._slots.release()
+
+	def close(self):
+		"""
+		Closes the idle connections.
+		"""
+
+		with self._lock:
+			idle, self._idle = self._idle, []
+
+		for conn, _ in idle:
+			conn.close()
@@ -7,10 +7,18 @@
 
 from __future__ import print_function
 
+import os
 import sys
 import json
+import hashlib
+import tempfile
 import argparse
 
+try:
+	from collections.abc import Mapping
+except ImportError:
+	from collections import Mapping
+
 try:
 	import ConfigParser
 except ImportError:
@@ -31,26 +39,164 @@ def FlexibleBool(arg):
 
 	raise argparse.ArgumentTypeError(msg)
 
-def serialize(obj, human=False):
+def _expand_mapping(obj):
+	# Mappings other than dicts, such as records.PackageRecords:
+	if isinstance(obj, Mapping):
+		return dict(obj.items())
+	raise TypeError('%r is not JSON serializable' % (obj,))
+
+def get_encoder(human=False):
 	"""
-	Encode an object using JSON.
+	Returns the JSON encoder used by serialize(). Keys are always sorted, so
+	that equal payloads are serialized identically.
 	"""
 	if human:
 		indent     = 2
-		sort_keys  = True
 		separators = (', ', ': ')
 	else:
 		indent     = None
-		sort_keys  = False
 		separators = (',', ':')
 
-	encoder = json.JSONEncoder( indent       = indent
-	                          , sort_keys    = sort_keys
-	                          , separators   = separators
-	                          , ensure_ascii = False # TODO: double check
+	return json.JSONEncoder( indent       = indent
+	                       , sort_keys    = True
+	                       , separators   = separators
+	                       , ensure_ascii = False # TODO: double check
+	                       , default      = _expand_mapping
 	)
 
-	return encoder.encode(obj)
+def serialize(obj, human=False):
+	"""
+	Encode an object using JSON.
+	"""
+	return get_encoder(human).encode(obj)
+
+class StreamingDict(object):
+	"""
+	A JSON object whose (key, value) pairs are produced by an iterator, for
+	use with iter_serialize(). The pairs are serialized in the order they
+	are produced and are not kept in memory.
+	"""
+
+	def __init__(self, pairs):
+		self.pairs = pairs
+
+	def __iter__(self):
+		return iter(self.pairs)
+
+# Never streamed (and quicker to rule out than with the Mapping ABC):
+_PLAIN_TYPES = (list, tuple, str, type(u''), int, float, type(None))
+
+def _is_streamed(obj):
+	if isinstance(obj, _PLAIN_TYPES):
+		return False
+	if isinstance(obj, dict):
+		return any(_is_streamed(v) for v in obj.values())
+
+	# Mappings other than dicts (e.g. records.PackageRecords) may build each
+	# value as it is looked up, so they are serialized one value at a time:
+	return isinstance(obj, (StreamingDict, Mapping))
+
+def _iter_serialize(obj, encoder, level):
+	if not _is_streamed(obj):
+		if encoder.indent is None:
+			for chunk in encoder.iterencode(obj):
+				yield chunk
+		else:
+			# Indent the continuation lines to the current level:
+			indent = '\n' + ' ' * (encoder.indent * level)
+			yield encoder.encode(obj).replace('\n', indent)
+		return
+
+	if isinstance(obj, StreamingDict):
+		pairs = iter(obj)
+	elif encoder.sort_keys:
+		pairs = ((key, obj[key]) for key in sorted(obj))
+	else:
+		pairs = iter(obj.items())
+
+	item_separator, key_separator = encoder.item_separator, encoder.key_separator
+	if encoder.indent is not None:
+		newline = '\n' + ' ' * (encoder.indent * (level + 1))
+		closing = '\n' + ' ' * (encoder.indent * level)
+	else:
+		newline = closing = ''
+
+	yield '{'
+
+	first = True
+	for key, value in pairs:
+		if first:
+			yield newline
+			first = False
+		else:
+			yield item_separator + newline
+
+		yield encoder.encode(key) + key_separator
+
+		for chunk in _iter_serialize(value, encoder, level + 1):
+			yield chunk
+
+	if not first:
+		yield closing
+
+	yield '}'
+
+def iter_serialize(obj, human=False):
+	"""
+	Like serialize(), but yields the JSON encoding of 'obj' in chunks. Any
+	StreamingDict in 'obj' is consumed as the chunks are generated, so the
+	output doesn't have to be built in memory.
+	"""
+	return _iter_serialize(obj, get_encoder(human), 0)
+
+def content_hash(obj):
+	"""
+	Returns the SHA-1 hex digest of a canonical JSON encoding of 'obj' (the
+	same as json.dumps(obj, sort_keys=True, separators=(',', ':'))), which is
+	hashed as it is generated.
+	"""
+	encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+	digest = hashlib.sha1()
+	for chunk in _iter_serialize(obj, encoder, 0):
+		digest.update(chunk.encode('utf_8'))
+	return digest.hexdigest()
+
+def atomic_write(path, data, mode=0o644):
+	"""
+	Writes 'data' (text or bytes, or an iterable of them) to 'path' through a
+	temporary file and a rename, creating the parent directory if needed.
+	Returns False on error.
+	"""
+
+	directory = os.path.dirname(path) or '.'
+	if isinstance(data, (type(u''), bytes)):
+		data = [data]
+
+	try:
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+	except (IOError, OSError):
+		return False
+
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			for chunk in data:
+				if isinstance(chunk, type(u'')):
+					chunk = chunk.encode('utf_8')
+				f.write(chunk)
+		os.chmod(tmp_path, mode)
+		os.rename(tmp_path, path)
+	except (IOError, OSError):
+		try:
+			os.unlink(tmp_path)
+		except OSError:
+			pass
+		return False
+
+	return True
 
 def get_auth_config(auth_file):
 	"""
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Bulk reader for the installed package database (/var/db/pkg).
+"""
+
+from __future__ import print_function
+
+import io
+import os
+
+# The files read for every installed package. Missing files are reported as
+# empty strings, just like vardbapi.aux_get() does. The recorded USE is only
+# used to look up the keyword: the reported IUSE and USE flags come from
+# gentoolkit, which reads the tree and the current profile (see Metadata).
+VDB_KEYS = ( 'repository', 'BUILD_TIME', 'SIZE'
+           , 'USE', 'PKGUSE', 'KEYWORDS'
+           )
+
+class VDBReader(object):
+	"""
+	Reads the metadata of all the installed packages straight from the vdb,
+	one directory per package, without going through vardbapi.
+	"""
+
+	def __init__(self, vdb_path, keys=VDB_KEYS):
+		"""
+		@param vdb_path Path to the vdb (usually $EROOT/var/db/pkg)
+		@type  vdb_path str
+		@param keys Names of the vdb files to read for each package
+		@type  keys tuple
+		"""
+
+		self.vdb_path = vdb_path
+		self.keys     = keys
+
+	def is_available(self):
+		"""
+		Returns True if the vdb can be read directly.
+		"""
+
+		return os.path.isdir(self.vdb_path) and \
+				os.access(self.vdb_path, os.R_OK | os.X_OK)
+
+	@staticmethod
+	def _is_valid_name(name):
+		# Skip hidden files and in-progress merges (e.g. '-MERGING-foo-1.0').
+		return not name.startswith('.') and not name.startswith('-')
+
+	def _listdir(self, path):
+		try:
+			return sorted(os.listdir(path))
+		except OSError:
+			return []
+
+	def get_categories(self):
+		"""
+		Returns the names of the categories in the vdb.
+		"""
+
+		return [category for category in self._listdir(self.vdb_path) \
+				if self._is_valid_name(category)]
+
+	def iter_cpvs(self, categories=None):
+		"""
+		Yields (cpv, path) for every installed package, or for those in the
+		given 'categories'.
+		"""
+
+		if categories is None:
+			categories = self.get_categories()
+		else:
+			categories = sorted(categories)
+
+		for category in categories:
+			if not self._is_valid_name(category):
+				continue
+
+			category_path = os.path.join(self.vdb_path, category)
+			if not os.path.isdir(category_path):
+				continue
+
+			for pf in self._listdir(category_path):
+				if not self._is_valid_name(pf):
+					continue
+
+				path = os.path.join(category_path, pf)
+				if os.path.isdir(path):
+					yield '%s/%s' % (category, pf), path
+
+	def list_cpvs(self):
+		"""
+		Returns the set of installed cpvs, from the directory listings alone
+		(unlike iter_cpvs(), the package entries aren't looked at).
+		"""
+
+		cpvs = set()
+		for category in self.get_categories():
+			for pf in self._listdir(os.path.join(self.vdb_path, category)):
+				if self._is_valid_name(pf):
+					cpvs.add('%s/%s' % (category, pf))
+
+		return cpvs
+
+	def is_merging(self, categories):
+		"""
+		Returns True if a package of one of 'categories' is being merged.
+		"""
+
+		for category in categories:
+			for name in self._listdir(os.path.join(self.vdb_path, category)):
+				if name.startswith('-MERGING-'):
+					return True
+
+		return False
+
+	def get_path(self, cpv):
+		"""
+		Returns the vdb directory of 'cpv'.
+		"""
+
+		return os.path.join(self.vdb_path, cpv)
+
+	def read_file(self, path, key):
+		"""
+		Returns the contents of the file 'key' in the vdb directory 'path', or
+		'' if it doesn't exist.
+		"""
+
+		try:
+			with io.open(os.path.join(path, key), encoding='utf_8', \
+					errors='replace') as f:
+				return f.read().strip()
+		except (IOError, OSError):
+			return ''
+
+	def read_entry(self, path):
+		"""
+		Returns a dictionary with self.keys read from the vdb directory 'path'.
+		"""
+
+		return dict((key, self.read_file(path, key)) for key in self.keys)
+
+	def open_entry(self, path):
+		"""
+		Like read_entry(), but each file is only read when it is first looked
+		up (see LazyEntry).
+		"""
+
+		return LazyEntry(self, path)
+
+	def iter_entries(self):
+		"""
+		Yields (cpv, entry) for every installed package in a single pass over
+		the vdb.
+		"""
+
+		for cpv, path in self.iter_cpvs():
+			yield cpv, self.read_entry(path)
+
+class LazyEntry(dict):
+	"""
+	A VDB entry that reads each of its reader's keys from the disk on first
+	access. Keys that the reader doesn't know about are missing, as usual.
+	"""
+
+	def __init__(self, reader, path):
+		dict.__init__(self)
+		self.reader = reader
+		self.path   = path
+
+	def __missing__(self, key):
+		if key not in self.reader.keys:
+			raise KeyError(key)
+
+		value = self[key] = self.reader.read_file(self.path, key)
+		return value
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+class EntryDB(object):
+	"""
+	A minimal vardbapi stand-in that serves aux_get() from VDB entries that
+	have already been read, so that code expecting a vardbapi (e.g.
+	gentoolkit's KeywordAnalyser) doesn't go back to the disk.
+	"""
+
+	def __init__(self, entries=None):
+		self.entries = entries if entries is not None else dict()
+
+	def add(self, cpv, entry):
+		self.entries[cpv] = entry
+
+	def aux_get(self, cpv, keys):
+		entry = self.entries[cpv]
+		return [entry.get(key, '') for key in keys]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# Copyright 2011 Vikraman Choudhury <vikraman.choudhury@gmail.com>
+# Copyright 2012 G. Gaydarov <ggaydarov@gmail.com>
+#
+# Distributed under the terms of the GNU General Public License v2 or later
+
+"""
+Run with: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname( \
+		os.path.abspath(__file__))), 'pym'))
+
+import gentoolkit.flag
+
+from gentoostats.metadata import Metadata
+
+CPV = 'net-misc/curl-7.29.0'
+
+# As recorded in the vdb:
+ENTRY = { 'repository': 'gentoo'
+        , 'BUILD_TIME': '1356998400'
+        , 'SIZE':       '1048576'
+        , 'USE':        'amd64 elibc_glibc kernel_linux ssl threads '
+                        'userland_GNU'
+        , 'PKGUSE':     '-ldap threads'
+        , 'KEYWORDS':   'amd64 ~arm x86'
+        }
+
+# What the per-cpv portage path reports for it. The flags aren't derived from
+# ENTRY (they come from the tree and the profile), and are deliberately not in
+# any canonical order:
+REFERENCE_FLAGS = (['threads', '+ssl', 'X', '-ldap'], ['threads', 'ssl'])
+
+class FakeVardb(object):
+	def __init__(self, entry):
+		self.entry = entry
+
+	def aux_get(self, cpv, keys):
+		return [self.entry[key] for key in keys]
+
+class FakeContext(object):
+	def __init__(self, entry):
+		self.vardb = FakeVardb(entry)
+
+class FlagsTest(unittest.TestCase):
+	def setUp(self):
+		self.context = FakeContext(ENTRY)
+		self.saved = (gentoolkit.flag.get_flags, gentoolkit.flag.get_installed_use)
+
+		def get_flags(cpv, final_setting=False):
+			self.assertEqual(cpv, CPV)
+			self.assertTrue(final_setting)
+			return list(REFERENCE_FLAGS[0]), list(REFERENCE_FLAGS[1])
+
+		def get_installed_use(cpv, use="USE"):
+			return self.context.vardb.aux_get(cpv, [use])[0].split()
+
+		gentoolkit.flag.get_flags         = get_flags
+		gentoolkit.flag.get_installed_use = get_installed_use
+
+	def tearDown(self):
+		gentoolkit.flag.get_flags, gentoolkit.flag.get_installed_use = self.saved
+
+	def test_both_paths_match_the_reference(self):
+		reference = { 'IUSE':   REFERENCE_FLAGS[0]
+		            , 'PKGUSE': gentoolkit.flag.get_installed_use(CPV, use="PKGUSE")
+		            , 'USE':    REFERENCE_FLAGS[1]
+		            }
+
+		from_vdb   = Metadata(CPV, context=self.context, entry=dict(ENTRY))
+		from_vardb = Metadata(CPV, context=self.context)
+
+		self.assertEqual(from_vdb.get_use_flag_information(), reference)
+		self.assertEqual(from_vardb.get_use_flag_information(), reference)
+
+if __name__ == '__main__':
+	unittest.main()